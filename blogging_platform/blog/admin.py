@@ -1,7 +1,173 @@
-from django.contrib import admin
-from .models import Post, Category, Tag
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+from .autocomplete import tag_index
+from .models import Post, Category, Tag, Comment, PostRating
+from .tasks import fan_out_published_post, refresh_related_posts, retract_unpublished_posts
 
-# Register your models here.
-admin.site.register(Post)
-admin.site.register(Category)
-admin.site.register(Tag)
+# Post ids per queued feed-retraction task
+RETRACT_CHUNK_SIZE = 1000
+
+
+def count_subquery(queryset, field):
+    """Correlated COUNT(*) for use in annotate().
+
+    A subquery per displayed row is cheaper on paginated changelists than a
+    JOIN + GROUP BY over the whole table.
+    """
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(total=Count('*')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def queue_related_refresh(post_ids):
+    # Bulk updates send no signals, so queue the refreshes post_save and
+    # m2m_changed would have queued
+    refresh_related_posts.enqueue_many([[pk] for pk in post_ids], [f'related:{pk}' for pk in post_ids])
+
+
+class PostActionForm(ActionForm):
+    # A text box rather than a select, so the changelist does not load every tag
+    tag = forms.ModelChoiceField(
+        queryset=Tag.objects.all(), to_field_name='name', required=False, widget=forms.TextInput,
+        help_text="Tag name, used by the tag actions.",
+    )
+
+
+@admin.register(Post)
+class PostAdmin(admin.ModelAdmin):
+    list_display = ('title', 'author', 'category', 'status', 'published_at', 'comment_count', 'like_count')
+    list_filter = ('status',)
+    list_select_related = ('author', 'category')
+    search_fields = ('^title', '=author__username', '=category__name')
+    raw_id_fields = ('author', 'likes')
+    autocomplete_fields = ('category', 'tags')
+    date_hierarchy = 'created_at'
+    action_form = PostActionForm
+    actions = ['publish_posts', 'unpublish_posts', 'add_tag', 'remove_tag']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            comment_count=count_subquery(Comment.objects.all(), 'post'),
+            like_count=count_subquery(Post.likes.through.objects.all(), 'post'),
+        )
+
+    @admin.display(ordering='comment_count', description='Comments')
+    def comment_count(self, obj):
+        return obj.comment_count
+
+    @admin.display(ordering='like_count', description='Likes')
+    def like_count(self, obj):
+        return obj.like_count
+
+    @admin.action(description="Publish selected posts")
+    def publish_posts(self, request, queryset):
+        post_ids = list(queryset.exclude(status='published').values_list('pk', flat=True))
+        updated = Post.objects.filter(pk__in=post_ids).update(status='published', published_at=now(), updated_at=now())
+        queue_related_refresh(post_ids)
+        fan_out_published_post.enqueue_many([[pk] for pk in post_ids], [f'fan-out:{pk}' for pk in post_ids])
+        self.message_user(request, f"{updated} post(s) published.", messages.SUCCESS)
+
+    @admin.action(description="Unpublish selected posts")
+    def unpublish_posts(self, request, queryset):
+        post_ids = list(queryset.exclude(status='draft').values_list('pk', flat=True))
+        updated = Post.objects.filter(pk__in=post_ids).update(status='draft', published_at=None, updated_at=now())
+        queue_related_refresh(post_ids)
+        retract_unpublished_posts.enqueue_many(
+            [[post_ids[start:start + RETRACT_CHUNK_SIZE]] for start in range(0, len(post_ids), RETRACT_CHUNK_SIZE)]
+        )
+        self.message_user(request, f"{updated} post(s) moved to draft.", messages.SUCCESS)
+
+    def _selected_tag(self, request):
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        if form.is_valid() and form.cleaned_data['tag']:
+            return form.cleaned_data['tag']
+        self.message_user(request, "Choose a tag for this action.", messages.ERROR)
+        return None
+
+    @admin.action(description="Add tag to selected posts")
+    def add_tag(self, request, queryset):
+        tag = self._selected_tag(request)
+        if tag is None:
+            return
+        through = Post.tags.through
+        post_ids = list(queryset.exclude(tags=tag).values_list('pk', flat=True))
+        created = through.objects.bulk_create(
+            [through(post_id=post_id, tag_id=tag.pk) for post_id in post_ids],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        tag_index.add_usage(tag.pk, len(created))
+        queue_related_refresh(post_ids)
+        self.message_user(request, f"Tagged {len(created)} post(s) with '{tag}'.", messages.SUCCESS)
+
+    @admin.action(description="Remove tag from selected posts")
+    def remove_tag(self, request, queryset):
+        tag = self._selected_tag(request)
+        if tag is None:
+            return
+        links = Post.tags.through.objects.filter(tag=tag)
+        post_ids = list(links.filter(post__in=queryset.values('pk')).values_list('post_id', flat=True))
+        deleted, _ = links.filter(post_id__in=post_ids).delete()
+        tag_index.add_usage(tag.pk, -deleted)
+        queue_related_refresh(post_ids)
+        self.message_user(request, f"Removed '{tag}' from {deleted} post(s).", messages.SUCCESS)
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'post_count')
+    search_fields = ('name',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            post_count=count_subquery(Post.objects.all(), 'category'),
+        )
+
+    @admin.display(ordering='post_count', description='Posts')
+    def post_count(self, obj):
+        return obj.post_count
+
+
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'post_count')
+    search_fields = ('name',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            post_count=count_subquery(Post.tags.through.objects.all(), 'tag'),
+        )
+
+    @admin.display(ordering='post_count', description='Posts')
+    def post_count(self, obj):
+        return obj.post_count
+
+
+@admin.register(Comment)
+class CommentAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'author', 'post', 'created_at')
+    list_select_related = ('author', 'post')
+    search_fields = ('=author__username',)
+    raw_id_fields = ('post', 'author')
+    date_hierarchy = 'created_at'
+    actions = ['delete_comments_by_author']
+
+    @admin.action(description="Delete all comments by the selected comments' authors")
+    def delete_comments_by_author(self, request, queryset):
+        # Resolve authors first: MySQL cannot DELETE from a table it also selects from
+        author_ids = set(queryset.values_list('author_id', flat=True))
+        deleted, _ = Comment.objects.filter(author_id__in=author_ids).delete()
+        self.message_user(request, f"{deleted} comment(s) deleted.", messages.SUCCESS)
+
+
+@admin.register(PostRating)
+class PostRatingAdmin(admin.ModelAdmin):
+    list_display = ('post', 'user', 'rating')
+    list_select_related = ('post', 'user')
+    list_filter = ('rating',)
+    search_fields = ('=user__username',)
+    raw_id_fields = ('post', 'user')
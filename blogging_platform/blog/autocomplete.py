@@ -0,0 +1,164 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+
+from django.db import connections
+from django.db.models import Count
+
+from .models import Category, Tag
+
+logger = logging.getLogger(__name__)
+
+# Workers only see signals for their own writes; a periodic reload bounds
+# how stale another worker's changes can be
+REFRESH_SECONDS = 300
+
+# Largest number of suggestions returned, and cached, per prefix
+MAX_LIMIT = 50
+
+# Ranked results are cached per queried prefix, since short prefixes match many names
+RESULT_CACHE_SIZE = 10000
+
+# A single sort of a million keys holds the GIL for over a second; sorting
+# chunks and merging them lets searches on other threads run in between
+SORT_CHUNK_SIZE = 10000
+
+
+class PrefixIndex:
+    """Names kept in a sorted array searched with bisect, ranked by usage count."""
+
+    def __init__(self, loader):
+        self.loader = loader  # Returns an iterable of (id, name, count)
+        self.lock = threading.RLock()
+        self.reload_lock = threading.Lock()  # Held by the one thread loading from the database
+        self.reloader = None  # The latest background reload thread
+        self.loaded_at = None
+        self._keys = None  # Sorted (lower-cased name, id) pairs; None until the first load
+        self._entries = {}  # id -> [lower-cased name, name, count]
+        self._results = {}  # Prefix -> ranked (name, count) pairs
+        self._pending = None  # Puts and removes made during a load, replayed onto its result
+
+    def reload(self):
+        with self.reload_lock:
+            self._load()
+
+    def _load(self):
+        # The query and the sort run outside ``lock``, so searches keep being
+        # answered from the current arrays until the new ones are swapped in
+        with self.lock:
+            self._pending = []
+        try:
+            entries = {pk: [name.lower(), name, count] for pk, name, count in self.loader()}
+            keys = [(entry[0], pk) for pk, entry in entries.items()]
+            keys = list(heapq.merge(*(
+                sorted(keys[start:start + SORT_CHUNK_SIZE]) for start in range(0, len(keys), SORT_CHUNK_SIZE)
+            )))
+        except BaseException:
+            with self.lock:
+                self._pending = None
+            raise
+        with self.lock:
+            pending, self._pending = self._pending, None
+            self._entries, self._keys, self._results = entries, keys, {}
+            self.loaded_at = time.monotonic()
+            for method, args in pending:
+                method(*args)
+
+    def _needs_reload(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > REFRESH_SECONDS
+
+    def _refresh(self):
+        # Until the first load finishes there is nothing to answer from, so
+        # wait for it; afterwards a stale index starts a reload on another
+        # thread and the search is answered from the current arrays
+        if self._keys is None:
+            with self.reload_lock:
+                if self._needs_reload():
+                    self._load()
+        elif self.reload_lock.acquire(blocking=False):
+            self.reloader = threading.Thread(target=self._reload_in_background, name='prefix-index-reload', daemon=True)
+            self.reloader.start()
+
+    def _reload_in_background(self):
+        try:
+            if self._needs_reload():
+                self._load()
+        except Exception:
+            # The next search of the still-stale index tries again
+            logger.exception("Reloading the prefix index failed")
+        finally:
+            self.reload_lock.release()
+            connections.close_all()  # This thread's connections only
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def search(self, prefix, limit=10):
+        """Return up to ``limit`` (name, count) pairs starting with ``prefix``, most used first."""
+        prefix = prefix.lower()
+        if self._needs_reload():
+            self._refresh()
+        with self.lock:
+            ranked = self._results.get(prefix)
+            if ranked is None:
+                start = bisect.bisect_left(self._keys, (prefix,))
+                end = bisect.bisect_left(self._keys, (prefix + '\U0010ffff',), start)
+                matches = [self._entries[pk] for _, pk in self._keys[start:end]]
+                matches.sort(key=lambda entry: (-entry[2], entry[0]))
+                ranked = [(name, count) for _, name, count in matches[:MAX_LIMIT]]
+                if len(self._results) >= RESULT_CACHE_SIZE:
+                    self._results.pop(next(iter(self._results)))
+                self._results[prefix] = ranked
+            return ranked[:min(limit, MAX_LIMIT)]
+
+    def _forget_results(self, key):
+        for length in range(len(key) + 1):
+            self._results.pop(key[:length], None)
+
+    def _unlink(self, pk):
+        entry = self._entries.pop(pk)
+        del self._keys[bisect.bisect_left(self._keys, (entry[0], pk))]
+        self._forget_results(entry[0])
+        return entry
+
+    def put(self, pk, name):
+        """Add an entry, or rename it keeping its usage count."""
+        with self.lock:
+            if self._pending is not None:
+                self._pending.append((self.put, (pk, name)))
+            if self._keys is None:
+                return  # Not loaded yet; the first search reads the database
+            count = self._unlink(pk)[2] if pk in self._entries else 0
+            key = name.lower()
+            self._entries[pk] = [key, name, count]
+            bisect.insort(self._keys, (key, pk))
+            self._forget_results(key)
+
+    def remove(self, pk):
+        with self.lock:
+            if self._pending is not None:
+                self._pending.append((self.remove, (pk,)))
+            if pk in self._entries:
+                self._unlink(pk)
+
+    def add_usage(self, pk, delta):
+        with self.lock:
+            entry = self._entries.get(pk)
+            if entry is not None:
+                entry[2] += delta
+                self._forget_results(entry[0])
+
+
+def _load_tags():
+    return Tag.objects.annotate(count=Count('post')).values_list('id', 'name', 'count').iterator(chunk_size=10000)
+
+
+def _load_categories():
+    return Category.objects.annotate(count=Count('post')).values_list('id', 'name', 'count')
+
+
+tag_index = PrefixIndex(_load_tags)
+category_index = PrefixIndex(_load_categories)
@@ -0,0 +1,515 @@
+"""Performance benchmarks, run with ``manage.py benchmark``.
+
+Each benchmark fills an empty throwaway database with generated rows at the
+size named in its docstring (``--scale`` shrinks or grows every size) and
+reports timings, query counts and peak Python memory.
+"""
+import hashlib
+import itertools
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from . import taskqueue
+from .models import Category, Post, Tag
+
+BATCH_SIZE = 5000
+
+WORDS = (
+    'python django database index query cache latency memory thread worker queue '
+    'stream feed sitemap search tag category author rating comment review release '
+    'deploy scale shard buffer token bucket revision delta snapshot vector'
+).split()
+
+# Rarer title terms, so term frequencies fall off the way real titles do
+VOCABULARY = [f'{a}{b}{c}' for a in ('ka', 'lo', 'mi', 'nu', 'pe', 'ro', 'si', 'tu') for b in 'aeiou' for c in range(250)]
+
+registry = {}
+
+
+def benchmark(func):
+    """Register a benchmark; it is called as ``func(scale, out)``."""
+    registry[func.__name__] = func
+    return func
+
+
+def scaled(size, scale):
+    return max(1, int(size * scale))
+
+
+@contextmanager
+def measure(out, label, memory=False):
+    """Report the wall time (and optionally the peak traced memory) of the block.
+
+    Tracing memory slows Python code down noticeably, so it is opt-in.
+    """
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        line = f"{label}: {elapsed:.3f}s"
+        if memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            line += f", peak {peak / 2 ** 20:.1f} MB"
+        out(line)
+
+
+def per_call(func, calls):
+    """Average microseconds per call of ``func()`` over ``calls`` calls."""
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def count_queries(func):
+    """Return (result, number of queries) for ``func()``."""
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        result = func()
+    return result, len(queries)
+
+
+def make_users(count, prefix='bench'):
+    start = User.objects.count()
+    User.objects.bulk_create(
+        [User(username=f'{prefix}{start + i}') for i in range(count)], batch_size=BATCH_SIZE,
+    )
+    return list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+
+
+def make_posts(count, author_ids, categories=0, tags=0, tags_per_post=3, status='published', seed=0):
+    """Bulk-create ``count`` posts (plus categories and tags) and return their ids.
+
+    Titles mix one common word with two rarer ones.
+    """
+    rng = random.Random(seed)
+    Category.objects.bulk_create(
+        [Category(name=f'category-{i}') for i in range(categories)], batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+    Tag.objects.bulk_create(
+        [Tag(name=f'tag-{i}') for i in range(tags)], batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+    category_ids = list(Category.objects.values_list('id', flat=True))
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+
+    first_new = (Post.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    for start in range(0, count, BATCH_SIZE):
+        Post.objects.bulk_create([
+            Post(
+                author_id=rng.choice(author_ids),
+                category_id=rng.choice(category_ids) if category_ids else None,
+                title=f'{rng.choice(WORDS)} {rng.choice(VOCABULARY)} {rng.choice(VOCABULARY)}',
+                content=' '.join(rng.choices(WORDS, k=40)),
+                status=status,
+            )
+            for _ in range(min(BATCH_SIZE, count - start))
+        ])
+    post_ids = list(Post.objects.filter(id__gte=first_new).values_list('id', flat=True))
+
+    if tag_ids and tags_per_post:
+        through = Post.tags.through
+        links = [
+            through(post_id=post_id, tag_id=tag_id)
+            for post_id in post_ids
+            for tag_id in rng.sample(tag_ids, min(tags_per_post, len(tag_ids)))
+        ]
+        through.objects.bulk_create(links, batch_size=BATCH_SIZE)
+    return post_ids
+
+
+@benchmark
+def related_posts(scale, out):
+    """Full and incremental related-post builds at 100k posts, and the read path."""
+    from django.test import Client
+
+    from .similarity import rebuild_related_posts, update_related_posts
+
+    size = scaled(100000, scale)
+    post_ids = make_posts(size, make_users(100), categories=50, tags=2000)
+    out(f"{size} posts, 50 categories, 2000 tags, 3 tags per post")
+
+    with measure(out, "Full rebuild"):
+        written = rebuild_related_posts()
+    out(f"  {written} related-post rows")
+    with measure(out, "Full rebuild with memory tracing", memory=True):
+        rebuild_related_posts()
+
+    sample = random.Random(1).sample(post_ids, min(100, len(post_ids)))
+    with measure(out, f"Incremental update of {len(sample)} posts"):
+        for post_id in sample:
+            update_related_posts(post_id)
+
+    client = Client()
+    url = f'/api/posts/{sample[0]}/related/'
+    _, queries = count_queries(lambda: client.get(url))
+    out(f"Related-posts request: {per_call(lambda: client.get(url), 100):.0f}us, {queries} queries")
+
+
+@benchmark
+def throttle_overhead(scale, out):
+    """Per-request cost of the token-bucket check, in-process and through a cache."""
+    from django.core.cache import caches
+    from django.test.utils import override_settings
+    from rest_framework.test import APIRequestFactory
+
+    from .throttling import LoginThrottle, local_store
+
+    calls = scaled(100000, scale)
+    request = APIRequestFactory().post('/api/login/')
+    request.user = None
+    throttle = LoginThrottle()
+    big_limit = {'DEFAULT_THROTTLE_RATES': {'login': '1000000000/s'}, 'NUM_PROXIES': 1}
+
+    with override_settings(REST_FRAMEWORK=big_limit):
+        local_store.clear()
+        out(f"Local store, one client: {per_call(lambda: throttle.allow_request(request, None), calls):.2f}us per check")
+
+        clients = iter(range(calls))
+
+        def new_client():
+            request.META['REMOTE_ADDR'] = f'10.{next(clients)}'
+            throttle.allow_request(request, None)
+
+        out(f"Local store, {calls} distinct clients: {per_call(new_client, calls):.2f}us per check")
+
+        with override_settings(
+            BLOG_THROTTLE_CACHE='benchmark',
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                    'benchmark': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ):
+            caches['benchmark'].clear()
+            out(f"Local-memory cache store: {per_call(lambda: throttle.allow_request(request, None), calls):.2f}us per check")
+    local_store.clear()
+
+
+@benchmark
+def admin_bulk_actions(scale, out):
+    """Changelist and bulk-action cost on 10k posts, through the admin."""
+    from django.test import Client
+
+    size = scaled(10000, scale)
+    make_posts(size, make_users(50), categories=20, tags=100, status='draft')
+    User.objects.create_superuser('bench-admin', 'admin@example.com', 'secret123')
+    client = Client()
+    client.force_login(User.objects.get(username='bench-admin'))
+    out(f"{size} posts")
+
+    _, queries = count_queries(lambda: client.get('/admin/blog/post/'))
+    out(f"Changelist: {per_call(lambda: client.get('/admin/blog/post/'), 20) / 1000:.1f}ms, {queries} queries")
+
+    for action, extra in [
+        ('publish_posts', {}),
+        ('add_tag', {'tag': 'tag-0'}),
+        ('remove_tag', {'tag': 'tag-0'}),
+        ('unpublish_posts', {}),
+    ]:
+        data = {'action': action, 'select_across': 1, 'index': 0, '_selected_action': [0], **extra}
+        with measure(out, f"{action} on every post"):
+            _, queries = count_queries(lambda: client.post('/admin/blog/post/', data))
+        out(f"  {queries} queries")
+
+
+@benchmark
+def feed(scale, out):
+    """Publish fan-out cost and feed read latency for an author with 10k followers."""
+    from unittest import mock
+
+    from django.utils.timezone import now
+
+    from . import timeline
+    from .models import AuthorStats, FeedEntry, Follow
+
+    followers = scaled(10000, scale)
+    author_id = make_users(1, prefix='author')[0]
+    follower_ids = make_users(followers, prefix='follower')
+    Follow.objects.bulk_create([Follow(follower_id=pk, followed_id=author_id) for pk in follower_ids], batch_size=BATCH_SIZE)
+    AuthorStats.objects.create(user_id=author_id, follower_count=followers)
+    post_ids = make_posts(timeline.FEED_LENGTH, [author_id])
+    Post.objects.filter(pk__in=post_ids).update(published_at=now())
+    posts = list(Post.objects.filter(pk__in=post_ids))
+    out(f"{followers} followers, {len(posts)} posts")
+
+    # Measured with the author under the limit, whatever the default limit is
+    with mock.patch.object(timeline, 'FANOUT_FOLLOWER_LIMIT', followers):
+        with measure(out, "Fan-out of 20 posts"):
+            for post in posts[:20]:
+                timeline.fan_out_post(post)
+        for post in posts[20:]:
+            timeline.fan_out_post(post)
+        out(f"  {FeedEntry.objects.count()} timeline rows in total")
+
+        reader = follower_ids[0]
+        _, queries = count_queries(lambda: timeline.read_feed(reader))
+        out(f"First page of a fanned-out feed: {per_call(lambda: timeline.read_feed(reader), 200):.0f}us, {queries} queries")
+        cursor = timeline.decode_cursor(timeline.read_feed(reader, limit=len(posts) // 2)[1])
+        out(f"Page from the middle: {per_call(lambda: timeline.read_feed(reader, cursor=cursor), 200):.0f}us")
+
+    FeedEntry.objects.all().delete()
+    with mock.patch.object(timeline, 'FANOUT_FOLLOWER_LIMIT', followers - 1):
+        _, queries = count_queries(lambda: timeline.read_feed(reader))
+        out(f"First page merged at read time: {per_call(lambda: timeline.read_feed(reader), 200):.0f}us, {queries} queries")
+
+
+@benchmark
+def startup(scale, out):
+    """Cold-start import time of manage.py and the WSGI application, best of 5 runs."""
+    from .management.commands.profile_imports import STARTUP_BUDGET_MS, profile_startup, startup_cpu_ms
+
+    runs = scaled(5, scale)
+    for target in ('manage', 'wsgi'):
+        timings = sorted(profile_startup(target)[0] for _ in range(runs))
+        cpu = sorted(startup_cpu_ms(target) for _ in range(runs))
+        out(f"{target}: imports best {timings[0]:.0f}ms, median {timings[len(timings) // 2]:.0f}ms; "
+            f"CPU best {cpu[0]:.0f}ms, median {cpu[len(cpu) // 2]:.0f}ms (budget {STARTUP_BUDGET_MS}ms)")
+
+
+@benchmark
+def revisions(scale, out):
+    """Storage and latency of 500 small edits to a 20 KB post, through the API."""
+    from django.db.models import Sum
+    from django.db.models.functions import Length
+    from rest_framework.test import APIClient
+
+    from .models import PostRevision
+    from .revisions import revision_content
+
+    edits = scaled(500, scale)
+    rng = random.Random(0)
+    author = User.objects.create_user('bench-author')
+    words = rng.choices(WORDS + VOCABULARY[:200], k=3000)
+    post = Post.objects.create(author=author, title='Revised', content=' '.join(words), status='published')
+    client = APIClient()
+    client.force_authenticate(author)
+    out(f"{edits} edits to a {len(post.content) // 1024} KB post, a few words each")
+
+    started = time.perf_counter()
+    for _ in range(edits):
+        for _ in range(3):
+            words[rng.randrange(len(words))] = rng.choice(VOCABULARY)
+        client.patch(f'/api/posts/{post.pk}/', {'content': ' '.join(words)}, format='json')
+    out(f"Edit with revision: {(time.perf_counter() - started) / edits * 1000:.1f}ms per edit")
+
+    stored = PostRevision.objects.filter(post=post).aggregate(size=Sum(Length('data')))['size']
+    full = len(post.content) * (edits + 1)
+    out(f"Stored history: {stored / 1024:.0f} KB vs {full / 1024:.0f} KB of full copies ({full / stored:.0f}x smaller)")
+    numbers = rng.sample(range(1, edits + 2), min(50, edits + 1))
+    numbers = itertools.cycle(numbers)
+    out(f"Rebuilding a revision: {per_call(lambda: revision_content(post.pk, next(numbers)), 200) / 1000:.2f}ms")
+
+
+@benchmark
+def autocomplete(scale, out):
+    """Tag prefix search over 1M tags, and the longest search stall during a reload."""
+    from .autocomplete import tag_index
+
+    size = scaled(1000000, scale)
+    Tag.objects.bulk_create([Tag(name=f'{VOCABULARY[i % len(VOCABULARY)]}-{i}') for i in range(size)], batch_size=BATCH_SIZE)
+    out(f"{size} tags")
+
+    with measure(out, "Load and sort", memory=True):
+        tag_index.reload()
+    prefixes = iter([VOCABULARY[i % len(VOCABULARY)][:3 + i % 3] for i in range(1000)] * 2)
+    out(f"Uncached search: {per_call(lambda: tag_index.search(next(prefixes)), 1000):.0f}us")
+    out(f"Cached search: {per_call(lambda: tag_index.search(next(prefixes)), 1000):.0f}us")
+
+    tag_index.invalidate()
+    started = time.perf_counter()
+    tag_index.search('ka')
+    out(f"Search of a stale index: {(time.perf_counter() - started) * 1e6:.0f}us, reloading in the background")
+    reloader = tag_index.reloader
+    stalls = []
+    while reloader.is_alive():
+        started = time.perf_counter()
+        tag_index.search('lo')
+        stalls.append(time.perf_counter() - started)
+    reloader.join()
+    stalls.sort()
+    # Searches no longer wait for the index lock; the longest pauses left are
+    # the garbage collector walking the freshly loaded objects
+    out(f"During a reload: {len(stalls)} searches, "
+        f"p99 {stalls[int(len(stalls) * 0.99)] * 1e6:.0f}us, longest {stalls[-1] * 1000:.0f}ms")
+
+
+@benchmark
+def edit_contention(scale, out):
+    """Committed edits per second when 1, 4 and 16 clients edit one post, retrying on 409."""
+    import contextlib
+    import threading
+
+    from rest_framework.test import APIClient
+
+    edits = scaled(200, scale)
+    author = User.objects.create_user('bench-editor')
+    post = Post.objects.create(author=author, title='Contended', content='Initial content.', status='published')
+    url = f'/api/posts/{post.pk}/'
+    # sqlite's shared in-memory test database fails a request that meets
+    # another's write rather than making it wait, so there requests take
+    # turns; the read-then-write cycles of different clients still interleave
+    request_lock = threading.Lock() if connection.vendor == 'sqlite' else contextlib.nullcontext()
+
+    for writers in (1, 4, 16):
+        conflicts = []
+        # At small scales every writer still makes one edit
+        per_writer = max(1, edits // writers)
+
+        def edit(i):
+            client = APIClient()
+            client.force_authenticate(author)
+            retries = 0
+            try:
+                for n in range(per_writer):
+                    while True:
+                        with request_lock:
+                            version = client.get(url).json()['version']
+                        with request_lock:
+                            response = client.patch(url, {'content': f'Writer {i}, edit {n}.', 'version': version}, format='json')
+                        if response.status_code == 200:
+                            break
+                        retries += 1
+            finally:
+                conflicts.append(retries)
+                connection.close()
+
+        threads = [threading.Thread(target=edit, args=(i,)) for i in range(writers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        committed = per_writer * writers
+        out(f"{writers} writers: {committed / elapsed:.0f} edits/s, {sum(conflicts) / committed:.2f} conflicts per edit")
+
+
+@benchmark
+def sitemaps(scale, out):
+    """Full and incremental sitemap builds over 1M posts, and a cached tag feed."""
+    import tempfile
+
+    from django.test import Client
+    from django.test.utils import override_settings
+    from django.utils.timezone import now
+
+    from .syndication import build_sitemaps
+
+    size = scaled(1000000, scale)
+    post_ids = make_posts(size, make_users(100), tags=1000, tags_per_post=1)
+    out(f"{size} posts")
+
+    with tempfile.TemporaryDirectory() as root, override_settings(SYNDICATION_ROOT=root):
+        with measure(out, "Full build"):
+            rebuilt, total = build_sitemaps()
+        out(f"  {rebuilt} of {total} files written")
+        with measure(out, "Full build with memory tracing", memory=True):
+            build_sitemaps(force=True)
+        with measure(out, "Build with nothing changed"):
+            build_sitemaps()
+        Post.objects.filter(pk=post_ids[len(post_ids) // 2]).update(title='Edited', updated_at=now())
+        with measure(out, "Build after one edit"):
+            rebuilt, _ = build_sitemaps()
+        out(f"  {rebuilt} file rewritten")
+
+        client = Client()
+        client.get('/feeds/tag/tag-0/')
+        _, queries = count_queries(lambda: client.get('/feeds/tag/tag-0/'))
+        out(f"Unchanged tag feed: {per_call(lambda: client.get('/feeds/tag/tag-0/'), 50) / 1000:.1f}ms, {queries} queries")
+
+
+@taskqueue.task()
+def digest_task(seed):
+    """Stand-in task for the worker drain: CPU-bound and database-free, since
+    spawned workers connect to the configured database, not the throwaway one."""
+    return hashlib.sha256(str(seed).encode() * 1000).hexdigest()
+
+
+@benchmark
+def task_queue(scale, out):
+    """Enqueue rates of 10k tasks on the memory and database brokers, and their drain through a two-process worker."""
+    size = scaled(10000, scale)
+    name = digest_task.task_name
+    for broker in (taskqueue.MemoryBroker(), taskqueue.DatabaseBroker()):
+        label = type(broker).__name__
+        keys = iter(range(size))
+        out(f"{label} enqueue: {per_call(lambda: broker.enqueue(name, [0], dedup_key=f'k{next(keys)}'), size):.0f}us per task")
+        started = time.perf_counter()
+        broker.enqueue_many(name, [[i] for i in range(size)], [f'm{i}' for i in range(size)])
+        out(f"{label} enqueue_many: {(time.perf_counter() - started) / size * 1e6:.0f}us per task")
+        keys = iter(range(size))
+        out(f"{label} duplicate enqueue: {per_call(lambda: broker.enqueue(name, [0], dedup_key=f'k{next(keys)}'), size):.0f}us per task")
+        with measure(out, f"{label} worker drain of {broker.pending_count()} tasks"):
+            taskqueue.run_worker(broker, processes=2, batch_size=500, once=True)
+
+
+@benchmark
+def stream_posts(scale, out):
+    """Time and peak memory of streaming one author's posts at 1k, 10k, 100k and 1M rows."""
+    from django.test import Client
+
+    author_id = make_users(1, prefix='streamer')[0]
+    fans = make_users(100, prefix='fan')
+    username = User.objects.get(pk=author_id).username
+    client = Client()
+    created = 0
+    for size in (1000, 10000, 100000, 1000000):
+        size = scaled(size, scale)
+        post_ids = make_posts(size - created, [author_id], tags=50, tags_per_post=2, seed=created)
+        if not created:
+            # A popular first page: a hundred likers on each of its posts
+            Post.likes.through.objects.bulk_create(
+                [Post.likes.through(post_id=pk, user_id=fan) for pk in post_ids[:1000] for fan in fans],
+                batch_size=BATCH_SIZE,
+            )
+        created = size
+        with measure(out, f"{size} posts", memory=True):
+            streamed = sum(len(chunk) for chunk in client.get(f'/api/posts/author/{username}/').streaming_content)
+        out(f"  {streamed / 2 ** 20:.1f} MB of JSON")
+
+
+@benchmark
+def view_counts(scale, out):
+    """Buffered view recording from 1, 4 and 16 threads, the flush, and unique-viewer accuracy."""
+    import threading
+
+    from .viewcounts import HyperLogLog, ViewBuffer, unique_viewers
+
+    post_ids = make_posts(1000, make_users(10))
+    views = scaled(200000, scale)
+    for threads in (1, 4, 16):
+        buffer = ViewBuffer(flush_interval=None)
+        per_thread = views // threads
+
+        def record(seed):
+            rng = random.Random(seed)
+            for i in range(per_thread):
+                buffer.record(rng.choice(post_ids), viewer=f'user:{seed}:{i % 500}')
+
+        workers = [threading.Thread(target=record, args=(seed,)) for seed in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        used = sum(1 for _, hits, _ in buffer._shards if hits)
+        out(f"{threads} threads: {elapsed / (per_thread * threads) * 1e6:.2f}us per view, {used} shards used")
+    with measure(out, f"Flush of {len(post_ids)} posts"):
+        buffer.flush()
+    _, queries = count_queries(lambda: (buffer.record(post_ids[0], viewer='late'), buffer.flush()))
+    out(f"  {queries} queries for a flush of one post")
+    out(f"Unique viewers of one post: estimated {unique_viewers(post_ids[0])}")
+
+    for distinct in (1000, 100000, scaled(1000000, scale)):
+        sketch = HyperLogLog()
+        for i in range(distinct):
+            sketch.add(f'viewer:{i}')
+        out(f"HyperLogLog of {distinct} viewers: {(sketch.count() - distinct) / distinct:+.1%} error")
@@ -0,0 +1,41 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from blog.benchmarks import registry
+from blog.viewcounts import view_buffer
+
+
+class Command(BaseCommand):
+    help = "Run performance benchmarks against a throwaway test database (never the configured one)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Benchmarks to run (default: all).")
+        parser.add_argument('--scale', type=float, default=1.0, help="Multiply every data size by this factor.")
+        parser.add_argument('--list', action='store_true', help="List the benchmarks and exit.")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, func in registry.items():
+                self.stdout.write(f"{name}: {func.__doc__}")
+            return
+        names = options['names'] or list(registry)
+        unknown = set(names) - set(registry)
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # As under the test runner, queries are not logged; tasks queued by
+            # signals stay in memory instead of filling the Task table
+            with override_settings(DEBUG=False, BLOG_TASK_BROKER='memory', ALLOWED_HOSTS=['testserver']):
+                for name in names:
+                    self.stdout.write(self.style.MIGRATE_HEADING(name))
+                    registry[name](options['scale'], self.stdout.write)
+                    # Views recorded by requests belong to rows about to be flushed
+                    view_buffer.clear()
+                    call_command('flush', interactive=False, verbosity=0)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
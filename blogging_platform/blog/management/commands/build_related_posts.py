@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.similarity import TOP_K, rebuild_related_posts
+
+
+class Command(BaseCommand):
+    help = "Rebuild the related-posts index for all published posts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K, help="Neighbours stored per post.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = rebuild_related_posts(top_k=options['top_k'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} related-post entries in {elapsed:.2f}s"))
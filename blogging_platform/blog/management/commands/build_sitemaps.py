@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.syndication import build_sitemaps
+
+
+class Command(BaseCommand):
+    help = "Rebuild the sitemap files whose posts changed since the last build."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Rebuild every sitemap file.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuilt, total = build_sitemaps(force=options['force'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} of {total} sitemap files in {elapsed:.2f}s"))
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Code run in a fresh interpreter to reproduce each entry point's cold start
+TARGETS = {
+    'manage': "import django; django.setup()",
+    'wsgi': (
+        "import blogging_platform.wsgi; "
+        "from django.urls import get_resolver; get_resolver().url_patterns"
+    ),
+}
+
+
+# Cold-start budget enforced by blog/tests.py and by default here: roughly
+# twice a cold wsgi start, leaving room for slower CI machines
+STARTUP_BUDGET_MS = 800
+
+
+def parse_importtime(output):
+    """Parse ``python -X importtime`` output into (module, self_us, cumulative_us, depth) rows."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def profile_startup(target):
+    """Start ``target`` in a fresh interpreter; return (total import ms, parse_importtime rows)."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'blogging_platform.settings'))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', TARGETS[target]],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise CommandError(f"Startup failed:\n{result.stderr}")
+    rows = parse_importtime(result.stderr)
+    return sum(cumulative for _, _, cumulative, depth in rows if depth == 0) / 1000, rows
+
+
+def startup_cpu_ms(target):
+    """CPU time ``target`` takes to start in a fresh interpreter.
+
+    Unlike wall time, it barely moves when other processes compete for the
+    machine, so the test suite checks the budget against it.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'blogging_platform.settings'))
+    result = subprocess.run(
+        [sys.executable, '-c', f"{TARGETS[target]}; import time; print(time.process_time())"],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise CommandError(f"Startup failed:\n{result.stderr}")
+    return float(result.stdout.split()[-1]) * 1000
+
+
+class Command(BaseCommand):
+    help = "Report per-module import cost of a cold manage.py or wsgi.py start."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(TARGETS), default='wsgi')
+        parser.add_argument('--top', type=int, default=20, help="Number of modules to list.")
+        parser.add_argument(
+            '--max-ms', type=float, default=STARTUP_BUDGET_MS,
+            help="Fail if total import time exceeds this budget (default %(default)s; 0 disables the check).",
+        )
+
+    def handle(self, *args, **options):
+        total_ms, rows = profile_startup(options['target'])
+
+        self.stdout.write(f"{'self ms':>9} {'cumul ms':>9}  module")
+        for name, self_us, cumulative_us, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:options['top']]:
+            self.stdout.write(f"{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {name}")
+        self.stdout.write(f"Total import time for {options['target']}: {total_ms:.1f} ms ({len(rows)} modules)")
+        self.stdout.write(f"CPU time of a start without import profiling: {startup_cpu_ms(options['target']):.1f} ms")
+
+        budget = options['max_ms']
+        if budget and total_ms > budget:
+            raise CommandError(f"Import time {total_ms:.1f} ms exceeds the {budget:.1f} ms budget")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from blog import tasks  # noqa: F401  Register the tasks before any are claimed
+from blog.taskqueue import run_worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks on a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None, help="Pool size (defaults to the CPU count).")
+        parser.add_argument('--batch-size', type=int, default=50, help="Tasks claimed per round trip.")
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty.")
+
+    def handle(self, *args, **options):
+        processed = run_worker(
+            processes=options['processes'],
+            batch_size=options['batch_size'],
+            once=options['once'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Ran {processed} task(s)"))
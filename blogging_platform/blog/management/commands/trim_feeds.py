@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog.timeline import FEED_LENGTH, trim_oversized_feeds
+
+
+class Command(BaseCommand):
+    help = "Trim every user's precomputed feed to its newest entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--length', type=int, default=FEED_LENGTH, help="Entries kept per user.")
+
+    def handle(self, *args, **options):
+        deleted = trim_oversized_feeds(length=options['length'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} feed entries"))
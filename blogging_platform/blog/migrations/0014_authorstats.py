@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_followers(apps, schema_editor):
+    Follow = apps.get_model('blog', 'Follow')
+    AuthorStats = apps.get_model('blog', 'AuthorStats')
+    counts = Follow.objects.values('followed_id').annotate(total=models.Count('id')).values_list('followed_id', 'total')
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=user_id, follower_count=total) for user_id, total in counts.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('blog', '0013_post_views_postdailyviewers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='author_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('follower_count', models.PositiveIntegerField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.RunPython(count_followers, migrations.RunPython.noop),
+    ]
@@ -27,19 +27,25 @@ class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)  # Author field
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)  # Post category
     tags = models.ManyToManyField(Tag, blank=True)  # Many-to-many relation with Tag
-    title = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, db_index=True)  # Indexed for admin prefix search
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Drives incremental sitemap/feed builds
     published_at = models.DateTimeField(blank=True, null=True)  # Optional published date
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='draft')  # New status field
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
     average_rating = models.FloatField(default=0.0)
+    version = models.PositiveIntegerField(default=1)  # Bumped on every edit, for optimistic concurrency
+    views = models.PositiveBigIntegerField(default=0)  # Flushed in batches by blog/viewcounts.py
 
     def publish(self):
         """Publish the post and set the published date."""
         self.status = 'published'
         self.published_at = now()
-        self.save()
+        self.save(update_fields=['status', 'published_at', 'updated_at'])
+
+        from .tasks import fan_out_published_post  # Imported here: tasks depend on these models
+        fan_out_published_post.enqueue(self.pk, dedup_key=f'fan-out:{self.pk}')
 
     def __str__(self):
         return self.title
@@ -57,4 +63,104 @@ class Comment(models.Model):
 class PostRating(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='ratings')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    rating = models.PositiveIntegerField()  # 1 to 5
\ No newline at end of file
+    rating = models.PositiveIntegerField()  # 1 to 5
+
+class RelatedPost(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_to')
+    score = models.FloatField()  # Cosine similarity of the two posts' feature vectors
+
+    class Meta:
+        unique_together = ('post', 'related')
+        indexes = [
+            models.Index(fields=['post', '-score'], name='blog_related_post_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.related_id} related to {self.post_id} ({self.score:.3f})"
+
+
+class Follow(models.Model):
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
+    followed = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('follower', 'followed')
+
+    def __str__(self):
+        return f"{self.follower_id} follows {self.followed_id}"
+
+
+class AuthorStats(models.Model):
+    # Kept up to date by signals on Follow, so feed reads never count followers
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='author_stats')
+    follower_count = models.PositiveIntegerField(default=0, db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.follower_count} followers"
+
+
+class FeedEntry(models.Model):
+    # Precomputed timeline row: only ids and the sort key, to keep the table narrow
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='feed_entries')
+    published_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-published_at', '-post'], name='blog_feed_user_time_idx'),
+        ]
+
+
+class PostRevision(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='revisions')
+    number = models.PositiveIntegerField()  # 1 for the first recorded version
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    is_snapshot = models.BooleanField(default=False)  # Full content rather than a delta
+    data = models.BinaryField()  # zlib-compressed snapshot or delta, see blog/revisions.py
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('post', 'number')
+        ordering = ['number']
+
+    def __str__(self):
+        return f"Revision {self.number} of post {self.post_id}"
+
+
+class Task(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=255)  # Registered task name, see blog/taskqueue.py
+    args = models.JSONField(default=list)
+    dedup_key = models.CharField(max_length=255, unique=True, null=True, blank=True)  # Cleared once a worker claims the task
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=now)  # Retry time, or lease expiry while running
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='blog_task_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class PostDailyViewers(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='daily_viewers')
+    day = models.DateField()
+    sketch = models.BinaryField()  # HyperLogLog registers of the day's viewers
+
+    class Meta:
+        unique_together = ('post', 'day')
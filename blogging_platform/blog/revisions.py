@@ -0,0 +1,132 @@
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+
+from .models import PostRevision
+
+# Every Nth revision stores the full content, so rebuilding any version
+# applies at most SNAPSHOT_INTERVAL - 1 deltas
+SNAPSHOT_INTERVAL = 20
+
+# Diffs are computed over words with their trailing whitespace; matching
+# single characters is quadratic on long posts
+TOKEN_RE = re.compile(r'\S+\s*|\s+')
+
+
+def make_delta(previous, current):
+    """Describe ``current`` as copies from ``previous`` plus inserted text.
+
+    The delta is a list whose items are either ``[start, end]`` (copy that
+    slice of the previous version) or a string (insert it verbatim).
+    """
+    old_tokens = TOKEN_RE.findall(previous)
+    new_tokens = TOKEN_RE.findall(current)
+    old_offsets = _offsets(old_tokens)
+    new_offsets = _offsets(new_tokens)
+
+    delta = []
+    matcher = SequenceMatcher(None, old_tokens, new_tokens)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([old_offsets[i1], old_offsets[i2]])
+        elif tag in ('replace', 'insert'):
+            delta.append(current[new_offsets[j1]:new_offsets[j2]])
+    return delta
+
+
+def _offsets(tokens):
+    """Character offset of each token, plus the total length at the end."""
+    offsets = [0]
+    for token in tokens:
+        offsets.append(offsets[-1] + len(token))
+    return offsets
+
+
+def apply_delta(previous, delta):
+    return ''.join(previous[op[0]:op[1]] if isinstance(op, list) else op for op in delta)
+
+
+def _pack(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode(), 9)
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+# Attempts at claiming the next revision number before giving up
+RECORD_ATTEMPTS = 3
+
+
+def record_revision(post, previous_content, author=None):
+    """Store the post's current content as a new revision.
+
+    The delta is taken against the last stored revision, not against
+    ``previous_content``, so history stays consistent even if the caller read
+    the post before someone else's edit. ``previous_content`` is only used when
+    the post has no history yet, to record the original version first.
+    Call it in the transaction that saves the post. Returns the new
+    PostRevision, or None when the content did not change.
+    """
+    for attempt in range(RECORD_ATTEMPTS):
+        try:
+            # A savepoint, so a lost race for the number leaves the caller's transaction usable
+            with transaction.atomic():
+                return _record_revision(post, previous_content, author)
+        except IntegrityError:
+            # Another edit took the number between Max() and the insert
+            if attempt == RECORD_ATTEMPTS - 1:
+                raise
+
+
+def _last_number(post):
+    return PostRevision.objects.filter(post=post).aggregate(last=Max('number'))['last']
+
+
+def _record_revision(post, previous_content, author):
+    last = _last_number(post)
+    if last is None:
+        PostRevision.objects.create(post=post, number=1, is_snapshot=True, data=_pack(previous_content))
+        last, base = 1, previous_content
+    else:
+        base = revision_content(post.pk, last)
+    if post.content == base:
+        return None
+
+    number = last + 1
+    if (number - 1) % SNAPSHOT_INTERVAL == 0:
+        return PostRevision.objects.create(
+            post=post, number=number, author=author, is_snapshot=True, data=_pack(post.content),
+        )
+    return PostRevision.objects.create(
+        post=post, number=number, author=author, is_snapshot=False,
+        data=_pack(make_delta(base, post.content)),
+    )
+
+
+def revision_content(post_id, number):
+    """Rebuild the content of one revision, or return None if it does not exist.
+
+    Finds the nearest snapshot at or before ``number``, then loads it and the
+    deltas after it in one query.
+    """
+    snapshot = (
+        PostRevision.objects.filter(post_id=post_id, number__lte=number, is_snapshot=True)
+        .order_by('-number').values_list('number', flat=True).first()
+    )
+    if snapshot is None:
+        return None
+    chain = list(
+        PostRevision.objects.filter(post_id=post_id, number__gte=snapshot, number__lte=number)
+        .order_by('number').values_list('number', 'data')
+    )
+    if chain[-1][0] != number:
+        return None
+    content = _unpack(chain[0][1])
+    for _, data in chain[1:]:
+        content = apply_delta(content, _unpack(data))
+    return content
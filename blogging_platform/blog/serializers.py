@@ -1,13 +1,27 @@
 from django.utils.timezone import now
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
 from rest_framework import serializers
 from .models import Post, Category, Tag, Comment, PostRating
+from .timeline import retract_post
+from .tasks import fan_out_published_post
+
+
+class EditConflict(Exception):
+    """The post was changed by someone else since the client read it."""
+
 
 class PostSerializer(serializers.ModelSerializer):
     author = serializers.StringRelatedField(read_only=True)
     category = serializers.SlugRelatedField(slug_field='name', queryset=Category.objects.all(), required=False)
-    likes_count = serializers.IntegerField(source='likes.count', read_only=True)
+    likes_count = serializers.SerializerMethodField()
     average_rating = serializers.FloatField(read_only=True)
+    views = serializers.IntegerField(read_only=True)
+    # Changed through the like endpoint only, never by editing the post
+    likes = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    # Send back the version you read; the update is rejected if the post changed since
+    version = serializers.IntegerField(required=False)
     tags = serializers.SlugRelatedField(
         many=True, 
         slug_field='name',  # This must match the field in the Tag model
@@ -19,6 +33,11 @@ class PostSerializer(serializers.ModelSerializer):
         model = Post
         fields = '__all__'
 
+    def get_likes_count(self, obj):
+        # Lists annotate like_count so they never load the likes themselves
+        count = getattr(obj, 'like_count', None)
+        return obj.likes.count() if count is None else count
+
     # Custom validation for the title field
     def validate_title(self, value):
         if len(value) > 100:
@@ -51,17 +70,72 @@ class PostSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({"category": "Category is required."})
         return data
 
-    # Override the update method to handle status changes
+    # Override the update method to handle status changes and concurrent edits
     def update(self, instance, validated_data):
+        expected_version = validated_data.pop('version', instance.version)
+        revision_author = validated_data.pop('revision_author', None)
+        # Many-to-many fields are not columns: they cannot be assigned or
+        # saved with update_fields, so they are applied with set() below
+        many_to_many = {
+            field.name: validated_data.pop(field.name)
+            for field in Post._meta.many_to_many if field.name in validated_data
+        }
+        previous_content = instance.content
+
         # If status is updated to 'published', set the published_at field
-        if validated_data.get('status') == 'published' and instance.status != 'published':
+        published = validated_data.get('status') == 'published' and instance.status != 'published'
+        unpublished = validated_data.get('status') == 'draft' and instance.status != 'draft'
+        if published:
             validated_data['published_at'] = now()
         
         # If status is updated to 'draft', reset the published_at field
-        elif validated_data.get('status') == 'draft' and instance.status != 'draft':
+        elif unpublished:
             validated_data['published_at'] = None
 
-        return super().update(instance, validated_data)
+        changed = [attr for attr, value in validated_data.items() if getattr(instance, attr) != value]
+        with transaction.atomic():
+            # Claim the expected version in one conditional UPDATE instead of
+            # locking the row with select_for_update
+            claimed = Post.objects.filter(pk=instance.pk, version=expected_version).update(version=F('version') + 1)
+            if not claimed:
+                raise EditConflict()
+            if expected_version != instance.version:
+                # The instance was read before another edit, so it cannot tell
+                # what changed; the row is locked now, so read the current content
+                previous_content = Post.objects.values_list('content', flat=True).get(pk=instance.pk)
+                changed = list(validated_data)
+            instance.version = expected_version + 1
+            for attr in changed:
+                setattr(instance, attr, validated_data[attr])
+            if changed:
+                # Only write the columns this edit touched
+                instance.save(update_fields=changed + ['updated_at'])
+            for name, values in many_to_many.items():
+                # RelatedManager.set() diffs against the current rows and only
+                # inserts or deletes the through rows that changed
+                getattr(instance, name).set(values)
+            if 'content' in changed:
+                from .revisions import record_revision  # Imported on first edit; reads never need difflib
+
+                # In the same transaction as the version claim, so a saved edit always has its revision
+                record_revision(instance, previous_content, author=revision_author)
+
+        # Keep followers' timelines in step with the publication status
+        if published:
+            fan_out_published_post.enqueue(instance.pk, dedup_key=f'fan-out:{instance.pk}')
+        elif unpublished:
+            retract_post(instance)
+        return instance
+
+    def create(self, validated_data):
+        validated_data.pop('version', None)
+        validated_data.pop('revision_author', None)
+        if validated_data.get('status') == 'published':
+            validated_data.setdefault('published_at', now())
+        post = super().create(validated_data)
+        if post.status == 'published':
+            fan_out_published_post.enqueue(post.pk, dedup_key=f'fan-out:{post.pk}')
+        return post
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -0,0 +1,129 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .autocomplete import category_index, tag_index
+from .models import Category, Follow, Post, RelatedPost, Tag
+from .tasks import refresh_related_posts
+from .timeline import adjust_follower_count
+
+# Post fields that feed the related-posts similarity index
+SIMILARITY_FIELDS = {'title', 'category', 'status'}
+
+
+@receiver(post_save, sender=Post)
+def refresh_related_posts_on_save(sender, instance, created, update_fields=None, **kwargs):
+    # Saves that only touch unrelated columns (e.g. average_rating) leave the index alone
+    if update_fields is not None and not SIMILARITY_FIELDS.intersection(update_fields):
+        return
+    refresh_related_posts.enqueue(instance.pk, dedup_key=f'related:{instance.pk}')
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def refresh_related_posts_on_retag(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Tag side of the relation: every affected post needs refreshing
+        post_ids = pk_set or []
+    else:
+        post_ids = [instance.pk]
+    for post_id in post_ids:
+        refresh_related_posts.enqueue(post_id, dedup_key=f'related:{post_id}')
+
+
+@receiver(pre_delete, sender=Post)
+def remember_related_owners(sender, instance, **kwargs):
+    # The cascade removes the post from other posts' lists before post_delete
+    instance._related_owner_ids = list(
+        RelatedPost.objects.filter(related_id=instance.pk).values_list('post_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Post)
+def refill_related_posts_on_delete(sender, instance, **kwargs):
+    from .similarity import queue_refill
+
+    queue_refill(instance.__dict__.pop('_related_owner_ids', []))
+
+
+# Autocomplete prefix indexes
+
+@receiver(post_save, sender=Tag)
+def index_tag(sender, instance, **kwargs):
+    tag_index.put(instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Tag)
+def unindex_tag(sender, instance, **kwargs):
+    tag_index.remove(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_category(sender, instance, **kwargs):
+    category_index.put(instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category(sender, instance, **kwargs):
+    category_index.remove(instance.pk)
+
+
+@receiver(pre_save, sender=Post)
+def remember_stored_category(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (update_fields is not None and 'category' not in update_fields):
+        return
+    instance._stored_category_id = Post.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def recount_categories_on_save(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        stored = None
+    elif hasattr(instance, '_stored_category_id'):
+        stored = instance.__dict__.pop('_stored_category_id')
+    else:
+        return  # The category was not saved
+    if stored != instance.category_id:
+        if stored is not None:
+            category_index.add_usage(stored, -1)
+        if instance.category_id is not None:
+            category_index.add_usage(instance.category_id, 1)
+
+
+@receiver(pre_delete, sender=Post)
+def recount_on_post_delete(sender, instance, **kwargs):
+    # The post's tag links are removed by cascade, which sends no m2m_changed
+    for tag_id in Post.tags.through.objects.filter(post_id=instance.pk).values_list('tag_id', flat=True):
+        tag_index.add_usage(tag_id, -1)
+    if instance.category_id is not None:
+        category_index.add_usage(instance.category_id, -1)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def recount_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        if action == 'pre_clear':
+            tag_index.invalidate()
+        else:
+            tag_index.add_usage(instance.pk, len(pk_set) if action == 'post_add' else -len(pk_set))
+        return
+    if action == 'pre_clear':
+        pk_set = set(instance.tags.values_list('pk', flat=True))
+    delta = 1 if action == 'post_add' else -1
+    for tag_id in pk_set:
+        tag_index.add_usage(tag_id, delta)
+
+
+# Follower counts, which decide between fan-out on write and on read
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        adjust_follower_count(instance.followed_id, 1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_unfollow(sender, instance, **kwargs):
+    adjust_follower_count(instance.followed_id, -1)
@@ -0,0 +1,230 @@
+import heapq
+import math
+import re
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Post, RelatedPost
+from .tasks import refresh_related_posts
+
+# Number of neighbours stored per post
+TOP_K = 10
+
+# Features shared by more posts than this are too common to tell posts apart
+# and would make candidate generation quadratic, so they are left out
+MAX_FEATURE_DF = 1000
+
+# Relative weight of each feature kind in a post's vector
+FEATURE_WEIGHTS = {
+    'tag': 1.0,
+    'cat': 0.5,
+    'term': 0.3,
+}
+
+STOP_WORDS = {
+    'the', 'and', 'for', 'with', 'from', 'that', 'this', 'your', 'you',
+    'are', 'how', 'what', 'why', 'into', 'about', 'not', 'but', 'all',
+}
+
+TERM_RE = re.compile(r'[a-z0-9]+')
+
+
+def post_features(title, category_id, tag_ids):
+    """Return the set of feature keys describing a post."""
+    features = {('tag', tag_id) for tag_id in tag_ids}
+    if category_id is not None:
+        features.add(('cat', category_id))
+    for term in TERM_RE.findall(title.lower()):
+        if len(term) > 2 and term not in STOP_WORDS:
+            features.add(('term', term))
+    return features
+
+
+def _published_features(queryset=None):
+    """Map post id -> feature set for published posts, in two queries."""
+    if queryset is None:
+        queryset = Post.objects.filter(status='published')
+    rows = queryset.values_list('id', 'title', 'category_id')
+    tags = defaultdict(list)
+    for post_id, tag_id in Post.tags.through.objects.filter(post__in=queryset).values_list('post_id', 'tag_id'):
+        tags[post_id].append(tag_id)
+    return {
+        post_id: post_features(title, category_id, tags[post_id])
+        for post_id, title, category_id in rows
+    }
+
+
+def _unit_vector(features, df, total):
+    """Weight features by kind and inverse document frequency, scaled to unit length."""
+    vector = {
+        feature: FEATURE_WEIGHTS[feature[0]] * (math.log((1 + total) / (1 + df[feature])) + 1)
+        for feature in features
+    }
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {feature: weight / norm for feature, weight in vector.items()} if norm else {}
+
+
+def _vectorize(features_by_post):
+    """Turn feature sets into unit-length TF-IDF vectors (dicts of feature -> weight)."""
+    df = defaultdict(int)
+    for features in features_by_post.values():
+        for feature in features:
+            df[feature] += 1
+    total = len(features_by_post)
+    vectors = {}
+    for post_id, features in features_by_post.items():
+        vector = _unit_vector(features, df, total)
+        if vector:
+            vectors[post_id] = vector
+    return vectors, df
+
+
+def _inverted_index(vectors, df):
+    postings = defaultdict(list)
+    for post_id, vector in vectors.items():
+        for feature, weight in vector.items():
+            if df[feature] <= MAX_FEATURE_DF:
+                postings[feature].append((post_id, weight))
+    return postings
+
+
+def _neighbours(post_id, vector, postings, top_k):
+    scores = defaultdict(float)
+    for feature, weight in vector.items():
+        for other_id, other_weight in postings.get(feature, ()):
+            if other_id != post_id:
+                scores[other_id] += weight * other_weight
+    return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+def rebuild_related_posts(top_k=TOP_K, batch_size=1000):
+    """Recompute the top-K related posts of every published post.
+
+    Returns the number of RelatedPost rows written.
+    """
+    vectors, df = _vectorize(_published_features())
+    postings = _inverted_index(vectors, df)
+
+    with transaction.atomic():
+        RelatedPost.objects.all().delete()
+        batch = []
+        written = 0
+        for post_id, vector in vectors.items():
+            for related_id, score in _neighbours(post_id, vector, postings, top_k):
+                batch.append(RelatedPost(post_id=post_id, related_id=related_id, score=score))
+            if len(batch) >= batch_size:
+                RelatedPost.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        RelatedPost.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+def _feature_counts(tag_ids, category_ids):
+    """Number of published posts carrying each of the given tags and categories."""
+    df = defaultdict(int)
+    tag_counts = (
+        Post.tags.through.objects.filter(tag_id__in=tag_ids, post__status='published')
+        .values('tag_id').annotate(count=Count('post_id')).values_list('tag_id', 'count')
+    )
+    for tag_id, count in tag_counts:
+        df[('tag', tag_id)] = count
+    category_counts = (
+        Post.objects.filter(status='published', category_id__in=category_ids)
+        .values('category_id').annotate(count=Count('id')).values_list('category_id', 'count')
+    )
+    for category_id, count in category_counts:
+        df[('cat', category_id)] = count
+    return df
+
+
+def _corpus_document_frequencies(features_by_post):
+    """Document frequencies for an incremental update.
+
+    Tag and category frequencies are counted over all published posts so that
+    scores stay comparable with a full rebuild; title terms are not indexed in
+    the database and are counted within the neighbourhood instead.
+    """
+    tag_ids = {feature[1] for features in features_by_post.values() for feature in features if feature[0] == 'tag'}
+    category_ids = {feature[1] for features in features_by_post.values() for feature in features if feature[0] == 'cat'}
+    df = _feature_counts(tag_ids, category_ids)
+    for features in features_by_post.values():
+        for feature in features:
+            if feature[0] == 'term':
+                df[feature] += 1
+    return df, Post.objects.filter(status='published').count()
+
+
+def update_related_posts(post_id, top_k=TOP_K):
+    """Refresh the related-posts entries touching a single post.
+
+    Only posts sharing a tag or the category with the post are rescored, so the
+    cost is proportional to the post's neighbourhood rather than the corpus.
+    A post that is no longer published leaves every list it was in, and those
+    lists are queued to be refilled.
+    """
+    post = Post.objects.filter(pk=post_id).values('status', 'category_id').first()
+
+    with transaction.atomic():
+        RelatedPost.objects.filter(post_id=post_id).delete()
+        if post is None or post['status'] != 'published':
+            owner_ids = list(RelatedPost.objects.filter(related_id=post_id).values_list('post_id', flat=True))
+            RelatedPost.objects.filter(related_id=post_id).delete()
+            queue_refill(owner_ids)
+            return
+        RelatedPost.objects.filter(related_id=post_id).delete()
+
+        tag_ids = list(Post.tags.through.objects.filter(post_id=post_id).values_list('tag_id', flat=True))
+        category_id = post['category_id']
+        # Features above MAX_FEATURE_DF are not indexed, so they cannot make a
+        # neighbour; selecting candidates through them would load most of the corpus
+        counts = _feature_counts(tag_ids, [] if category_id is None else [category_id])
+        shares_features = Q(tags__in=[tag_id for tag_id in tag_ids if counts[('tag', tag_id)] <= MAX_FEATURE_DF])
+        if category_id is not None and counts[('cat', category_id)] <= MAX_FEATURE_DF:
+            shares_features |= Q(category_id=category_id)
+        candidate_ids = (
+            Post.objects.filter(status='published').filter(shares_features)
+            .values('id').distinct()
+        )
+        features_by_post = _published_features(Post.objects.filter(Q(id__in=candidate_ids) | Q(pk=post_id)))
+
+        df, total = _corpus_document_frequencies(features_by_post)
+        vector = _unit_vector(features_by_post.pop(post_id), df, total)
+        vectors = {other_id: _unit_vector(features, df, total) for other_id, features in features_by_post.items()}
+        neighbours = _neighbours(post_id, vector, _inverted_index(vectors, df), top_k)
+
+        RelatedPost.objects.bulk_create([
+            RelatedPost(post_id=post_id, related_id=related_id, score=score)
+            for related_id, score in neighbours
+        ])
+        _offer_to_neighbours(post_id, neighbours, top_k)
+
+
+def queue_refill(post_ids):
+    """Queue a refresh of posts whose lists lost an entry, so they are filled back to TOP_K."""
+    refresh_related_posts.enqueue_many([[pk] for pk in post_ids], [f'related:{pk}' for pk in post_ids])
+
+
+def _offer_to_neighbours(post_id, neighbours, top_k):
+    """Insert the post into each neighbour's list if it ranks in their top K."""
+    neighbour_ids = [related_id for related_id, _ in neighbours]
+    current = defaultdict(list)
+    for owner_id, entry_id, score in RelatedPost.objects.filter(post_id__in=neighbour_ids).values_list('post_id', 'id', 'score'):
+        current[owner_id].append((score, entry_id))
+
+    created = []
+    evicted = []
+    for related_id, score in neighbours:
+        entries = current[related_id]
+        if len(entries) < top_k:
+            created.append(RelatedPost(post_id=related_id, related_id=post_id, score=score))
+            continue
+        lowest_score, lowest_id = min(entries)
+        if score > lowest_score:
+            created.append(RelatedPost(post_id=related_id, related_id=post_id, score=score))
+            evicted.append(lowest_id)
+    RelatedPost.objects.filter(id__in=evicted).delete()
+    RelatedPost.objects.bulk_create(created)
@@ -0,0 +1,51 @@
+import json
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+# Rows fetched from the database and serialized per step
+STREAM_CHUNK_SIZE = 500
+
+
+def _encode(data):
+    return json.dumps(
+        data,
+        cls=JSONEncoder,
+        ensure_ascii=not api_settings.UNICODE_JSON,
+        allow_nan=not api_settings.STRICT_JSON,
+        separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': '),
+    )
+
+
+def stream_json_list(queryset, serializer_class, chunk_size=STREAM_CHUNK_SIZE):
+    """Return a StreamingHttpResponse rendering ``queryset`` as a JSON array.
+
+    Rows are read with queryset.iterator() and serialized one chunk at a time,
+    so memory use depends on ``chunk_size`` rather than on the result size.
+    Prefetches declared on the queryset are applied per chunk.
+    """
+    def generate():
+        rows = queryset.iterator(chunk_size=chunk_size)
+        # One serializer for every chunk: a bound serializer and its .data
+        # refer to each other, so one per chunk would keep each chunk's rows
+        # alive until the cycle collector ran
+        serializer = serializer_class(many=True)
+        separator = ''
+        yield '['
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch:
+                break
+            data = serializer.to_representation(batch)
+            for row in batch:
+                # Prefetched querysets refer back to their instance, likewise
+                row.__dict__.pop('_prefetched_objects_cache', None)
+            del batch
+            for item in data:
+                yield separator + _encode(item)
+                separator = ','
+        yield ']'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
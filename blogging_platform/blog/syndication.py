@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import Floor
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.text import slugify
+
+from .models import Post
+
+# Posts per sitemap file, by id range so a post always lands in the same file
+# (the sitemap protocol allows up to 50,000 URLs per file)
+SITEMAP_CHUNK_SIZE = 10000
+
+# Entries per Atom feed
+FEED_LENGTH = 50
+
+ITERATOR_CHUNK_SIZE = 2000
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def _root():
+    return Path(settings.SYNDICATION_ROOT)
+
+
+def _absolute(path):
+    return settings.SITE_URL.rstrip('/') + path
+
+
+@contextmanager
+def _atomic_write(path):
+    """Write to a temporary file and move it into place, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as out:
+        yield out
+    os.replace(tmp, path)
+
+
+def _post_url_template():
+    """Absolute post URL with a ``{}`` for the id: resolving the pattern once
+    per file instead of once per post makes writing a sitemap several times faster."""
+    sentinel = 987654321
+    return _absolute(reverse('post-detail', args=[sentinel])).replace(str(sentinel), '{}')
+
+
+def _fingerprint(last_updated, *counts):
+    return '|'.join([last_updated.isoformat() if last_updated else ''] + [str(count) for count in counts])
+
+
+# Sitemaps
+
+def sitemap_index_path():
+    return _root() / 'sitemap.xml'
+
+
+def sitemap_chunk_path(number):
+    return _root() / f'sitemap-{number}.xml'
+
+
+def _chunk_fingerprints():
+    """Map chunk number -> fingerprint of every post (any status) in its id range.
+
+    Counting all posts as well as published ones means unpublishing or
+    deleting a post also marks its chunk as changed.
+    """
+    rows = (
+        Post.objects.annotate(chunk=Floor(F('id') / SITEMAP_CHUNK_SIZE))
+        .values('chunk')
+        .annotate(
+            last_updated=Max('updated_at'),
+            total=Count('id'),
+            published=Count('id', filter=Q(status='published')),
+        )
+        .order_by('chunk')
+    )
+    return {
+        int(row['chunk']): _fingerprint(row['last_updated'], row['total'], row['published'])
+        for row in rows
+        if row['published']
+    }
+
+
+def _write_sitemap_chunk(number):
+    posts = (
+        Post.objects.filter(
+            status='published',
+            id__gte=number * SITEMAP_CHUNK_SIZE,
+            id__lt=(number + 1) * SITEMAP_CHUNK_SIZE,
+        )
+        .order_by('id')
+        .values_list('id', 'updated_at')
+    )
+    loc_template = escape(_post_url_template())
+    with _atomic_write(sitemap_chunk_path(number)) as out:
+        out.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n')
+        for post_id, updated_at in posts.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+            loc = loc_template.format(post_id)
+            out.write(f'<url><loc>{loc}</loc><lastmod>{updated_at.date().isoformat()}</lastmod></url>\n')
+        out.write('</urlset>\n')
+
+
+def _write_sitemap_index(chunks):
+    with _atomic_write(sitemap_index_path()) as out:
+        out.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NS}">\n')
+        for number in sorted(chunks):
+            loc = escape(_absolute(reverse('sitemap-section', args=[number])))
+            out.write(f'<sitemap><loc>{loc}</loc></sitemap>\n')
+        out.write('</sitemapindex>\n')
+
+
+def build_sitemaps(force=False):
+    """Regenerate the sitemap files whose posts changed since the last build.
+
+    Returns (chunks rebuilt, chunks in the index).
+    """
+    manifest_path = _root() / 'sitemap-manifest.json'
+    try:
+        previous = {int(k): v for k, v in json.loads(manifest_path.read_text()).items()}
+    except (FileNotFoundError, ValueError):
+        previous = {}
+    if force:
+        previous = {}
+
+    current = _chunk_fingerprints()
+    changed = [number for number, fingerprint in current.items() if previous.get(number) != fingerprint]
+    for number in changed:
+        _write_sitemap_chunk(number)
+    for number in previous.keys() - current.keys():
+        sitemap_chunk_path(number).unlink(missing_ok=True)
+
+    if changed or previous.keys() != current.keys() or not sitemap_index_path().exists():
+        _write_sitemap_index(current)
+        with _atomic_write(manifest_path) as out:
+            json.dump(current, out)
+    return len(changed), len(current)
+
+
+# Atom feeds
+
+FEED_SCOPES = {
+    'category': ('category__name', 'Posts in {}'),
+    'author': ('author__username', 'Posts by {}'),
+    'tag': ('tags__name', 'Posts tagged {}'),
+}
+
+
+def _feed_path(kind, value):
+    # Slug for readability plus a hash so distinct names never share a file
+    digest = hashlib.sha1(value.encode()).hexdigest()[:12]
+    return _root() / 'feeds' / kind / f'{slugify(value) or "feed"}-{digest}.xml'
+
+
+def build_feed(kind, value, link):
+    """Return the path of an up-to-date Atom feed, or None if it has no posts.
+
+    The file is only regenerated when the latest update time or the number
+    of published posts in the feed's scope has changed, or for a tag feed,
+    when posts were tagged or untagged.
+    """
+    lookup, title = FEED_SCOPES[kind]
+    posts = Post.objects.filter(status='published', **{lookup: value})
+    stats = posts.aggregate(last_updated=Max('updated_at'), published=Count('id', distinct=True))
+    if not stats['published']:
+        return None
+    counts = [stats['published']]
+    if kind == 'tag':
+        # Tagging a post does not touch its updated_at; every new link gets a
+        # higher id, so the newest link and the link count catch any retag
+        links = Post.tags.through.objects.filter(tag__name=value, post__status='published')
+        counts += links.aggregate(newest=Max('id'), total=Count('id')).values()
+
+    path = _feed_path(kind, value)
+    stamp_path = path.with_suffix('.fingerprint')
+    fingerprint = _fingerprint(stats['last_updated'], *counts)
+    if path.exists() and stamp_path.exists() and stamp_path.read_text() == fingerprint:
+        return path
+
+    feed = Atom1Feed(
+        title=title.format(value),
+        link=link,
+        description=title.format(value),
+        feed_url=link,
+        language=settings.LANGUAGE_CODE,
+    )
+    latest = (
+        posts.select_related('author').distinct()
+        .order_by('-published_at', '-id')
+        .only('id', 'title', 'content', 'published_at', 'updated_at', 'author__username')[:FEED_LENGTH]
+    )
+    for post in latest.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        url = _absolute(reverse('post-detail', args=[post.pk]))
+        feed.add_item(
+            title=post.title,
+            link=url,
+            description=post.content,
+            unique_id=url,
+            author_name=post.author.username,
+            pubdate=post.published_at,
+            updateddate=post.updated_at,
+        )
+    with _atomic_write(path) as out:
+        feed.write(out, 'utf-8')
+    with _atomic_write(stamp_path) as out:
+        out.write(fingerprint)
+    return path
@@ -0,0 +1,267 @@
+import itertools
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from .models import Task
+
+# A claimed task not finished within this time is handed to another worker
+LEASE_SECONDS = 300
+
+# Retry n of a failed task waits BACKOFF_BASE ** n seconds
+BACKOFF_BASE = 2
+
+ENQUEUE_BATCH_SIZE = 1000
+
+registry = {}
+
+
+def task(max_attempts=3):
+    """Register a function as a task and give it an ``enqueue(*args, dedup_key=None)`` method.
+
+    Arguments must be JSON-serializable. While a task with the same
+    ``dedup_key`` is still waiting to run, further enqueues are dropped.
+    ``enqueue_many(args_list, dedup_keys=None)`` queues one run per argument
+    list in a single round trip.
+    """
+    def decorator(func):
+        name = f'{func.__module__}.{func.__name__}'
+        registry[name] = func
+
+        def enqueue(*args, dedup_key=None):
+            return get_broker().enqueue(name, list(args), dedup_key=dedup_key, max_attempts=max_attempts)
+
+        def enqueue_many(args_list, dedup_keys=None):
+            args_list = [list(args) for args in args_list]
+            dedup_keys = dedup_keys or [None] * len(args_list)
+            return get_broker().enqueue_many(name, args_list, dedup_keys, max_attempts=max_attempts)
+
+        func.task_name = name
+        func.enqueue = enqueue
+        func.enqueue_many = enqueue_many
+        return func
+    return decorator
+
+
+def run_task(name, args):
+    if name not in registry:
+        # A fresh worker process registers a task when its module is imported
+        import_module(name.rpartition('.')[0])
+    return registry[name](*args)
+
+
+def backoff(attempts):
+    return timedelta(seconds=BACKOFF_BASE ** attempts)
+
+
+@dataclass
+class Job:
+    id: int
+    name: str
+    args: list
+    attempts: int  # Including the current one
+    max_attempts: int
+    dedup_key: str = None
+    run_after: object = field(default_factory=now)
+
+
+class DatabaseBroker:
+    """Stores tasks in the blog_task table; safe to share between workers."""
+
+    def enqueue(self, name, args, dedup_key=None, max_attempts=3):
+        try:
+            with transaction.atomic():
+                return Task.objects.create(name=name, args=args, dedup_key=dedup_key, max_attempts=max_attempts).pk
+        except IntegrityError:
+            return None  # Already queued under this dedup key
+
+    def enqueue_many(self, name, args_list, dedup_keys, max_attempts=3):
+        """Insert the tasks in batches; those whose dedup key is already queued are dropped."""
+        Task.objects.bulk_create(
+            [
+                Task(name=name, args=args, dedup_key=dedup_key, max_attempts=max_attempts)
+                for args, dedup_key in zip(args_list, dedup_keys)
+            ],
+            batch_size=ENQUEUE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def claim(self, limit):
+        current = now()
+        with transaction.atomic():
+            # Expired leases are picked up again, covering crashed workers
+            ready = Task.objects.filter(status__in=['pending', 'running'], run_after__lte=current).order_by('run_after')
+            if connection.features.has_select_for_update_skip_locked:
+                ready = ready.select_for_update(skip_locked=True)
+            rows = list(ready.values_list('id', 'name', 'args', 'attempts', 'max_attempts')[:limit])
+            # Releasing the dedup key lets changes made while the task runs queue a fresh run
+            Task.objects.filter(id__in=[row[0] for row in rows]).update(
+                status='running',
+                attempts=F('attempts') + 1,
+                dedup_key=None,
+                run_after=current + timedelta(seconds=LEASE_SECONDS),
+            )
+        return [Job(pk, name, args, attempts + 1, max_attempts) for pk, name, args, attempts, max_attempts in rows]
+
+    def complete(self, job):
+        Task.objects.filter(pk=job.id).delete()
+
+    def fail(self, job, error):
+        if job.attempts >= job.max_attempts:
+            Task.objects.filter(pk=job.id).update(status='failed', last_error=error)
+        else:
+            Task.objects.filter(pk=job.id).update(status='pending', last_error=error, run_after=now() + backoff(job.attempts))
+
+    def pending_count(self):
+        return Task.objects.filter(status__in=['pending', 'running']).count()
+
+
+class MemoryBroker:
+    """In-process stand-in for DatabaseBroker, for tests and single-process development."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.queued_keys = set()  # Dedup keys of jobs not yet claimed
+        self.failed = []
+        self._ids = itertools.count(1)
+
+    def enqueue(self, name, args, dedup_key=None, max_attempts=3):
+        with self.lock:
+            if dedup_key is not None:
+                if dedup_key in self.queued_keys:
+                    return None
+                self.queued_keys.add(dedup_key)
+            job = Job(next(self._ids), name, list(args), 0, max_attempts, dedup_key)
+            self.jobs[job.id] = job
+            return job.id
+
+    def enqueue_many(self, name, args_list, dedup_keys, max_attempts=3):
+        for args, dedup_key in zip(args_list, dedup_keys):
+            self.enqueue(name, args, dedup_key=dedup_key, max_attempts=max_attempts)
+
+    def claim(self, limit):
+        current = now()
+        with self.lock:
+            ready = sorted((job for job in self.jobs.values() if job.run_after <= current), key=lambda job: job.run_after)
+            for job in ready[:limit]:
+                job.attempts += 1
+                self.queued_keys.discard(job.dedup_key)
+                job.dedup_key = None
+                job.run_after = current + timedelta(seconds=LEASE_SECONDS)
+            return ready[:limit]
+
+    def complete(self, job):
+        with self.lock:
+            self.jobs.pop(job.id, None)
+
+    def fail(self, job, error):
+        with self.lock:
+            if job.attempts >= job.max_attempts:
+                self.failed.append((self.jobs.pop(job.id), error))
+            else:
+                job.run_after = now() + backoff(job.attempts)
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.jobs)
+
+
+class EagerBroker:
+    """Runs each task inline as soon as it is enqueued; for development without a worker."""
+
+    def enqueue(self, name, args, dedup_key=None, max_attempts=3):
+        run_task(name, args)
+        return None
+
+    def enqueue_many(self, name, args_list, dedup_keys, max_attempts=3):
+        for args in args_list:
+            run_task(name, args)
+
+
+BROKERS = {
+    'database': DatabaseBroker,
+    'memory': MemoryBroker,
+    'eager': EagerBroker,
+}
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the broker named by BLOG_TASK_BROKER (one shared instance per process)."""
+    kind = getattr(settings, 'BLOG_TASK_BROKER', 'database')
+    with _brokers_lock:
+        if kind not in _brokers:
+            _brokers[kind] = BROKERS[kind]()
+        return _brokers[kind]
+
+
+def _finish(broker, job, error=None):
+    if error is None:
+        broker.complete(job)
+    else:
+        broker.fail(job, error)
+
+
+def run_pending(broker=None, batch_size=50):
+    """Run every ready task in this process until none are left; returns the number run."""
+    broker = broker or get_broker()
+    processed = 0
+    while True:
+        jobs = broker.claim(batch_size)
+        if not jobs:
+            return processed
+        for job in jobs:
+            try:
+                run_task(job.name, job.args)
+            except Exception:
+                _finish(broker, job, traceback.format_exc())
+            else:
+                _finish(broker, job)
+            processed += 1
+
+
+def run_worker(broker=None, processes=None, batch_size=50, poll_interval=1.0, once=False):
+    """Claim tasks in batches and run them on a process pool.
+
+    With ``once`` the worker exits when no task is ready; returns the number run.
+    """
+    # Only worker processes need multiprocessing, so web workers never import it
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    import django
+
+    broker = broker or get_broker()
+    processed = 0
+    # Spawned rather than forked: a forked child inherits the parent's open
+    # database socket, and closing it there ends the parent's session too.
+    # The initializer must not import this module, which needs apps loaded.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=django.setup) as pool:
+        while True:
+            jobs = broker.claim(batch_size)
+            if not jobs:
+                if once:
+                    return processed
+                time.sleep(poll_interval)
+                continue
+            futures = {pool.submit(run_task, job.name, job.args): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    _finish(broker, futures[future], traceback.format_exc())
+                else:
+                    _finish(broker, futures[future])
+                processed += 1
@@ -0,0 +1,48 @@
+from django.db.models import Avg
+
+from .models import Post, PostRating
+from .taskqueue import task
+
+
+@task()
+def recompute_average_rating(post_id):
+    average = PostRating.objects.filter(post_id=post_id).aggregate(avg_rating=Avg('rating'))['avg_rating']
+    Post.objects.filter(pk=post_id).update(average_rating=average or 0.0)
+
+
+@task()
+def fan_out_published_post(post_id):
+    from .timeline import fan_out_post
+
+    post = Post.objects.filter(pk=post_id).first()
+    if post is not None:
+        fan_out_post(post)  # Skips posts unpublished since the task was queued
+
+
+@task()
+def refresh_related_posts(post_id):
+    from .similarity import update_related_posts
+
+    update_related_posts(post_id)
+
+
+@task()
+def trim_feeds(user_ids):
+    from .timeline import trim_oversized_feeds
+
+    trim_oversized_feeds(user_ids)
+
+
+@task()
+def retract_unpublished_posts(post_ids):
+    from .timeline import retract_posts
+
+    # Posts published again since the task was queued keep their timeline entries
+    retract_posts(Post.objects.filter(pk__in=post_ids).exclude(status='published').values_list('pk', flat=True))
+
+
+@task()
+def rebuild_sitemaps():
+    from .syndication import build_sitemaps
+
+    build_sitemaps()
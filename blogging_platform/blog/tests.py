@@ -1,3 +1,889 @@
-from django.test import TestCase
+import contextlib
+import gc
+import json
+import os
+import re
+import tempfile
+import threading
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+
+from . import revisions, similarity, syndication, taskqueue, timeline, viewcounts
+from .autocomplete import PrefixIndex, category_index, tag_index
+from .management.commands.profile_imports import STARTUP_BUDGET_MS, profile_startup, startup_cpu_ms
+from .models import (
+    AuthorStats, Category, Comment, FeedEntry, Follow, Post, PostDailyViewers, PostRating, PostRevision, RelatedPost, Tag,
+    Task,
+)
+from .throttling import LocalBucketStore, local_store
+
+
+def make_post(author, title, category=None, tags=(), status='published', content='Some post content here.'):
+    post = Post.objects.create(author=author, title=title, category=category, status=status, content=content)
+    post.tags.set(tags)
+    return post
+
+
+class RelatedPostsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='secret123')
+        cls.django = Category.objects.create(name='Django')
+        cls.cooking = Category.objects.create(name='Cooking')
+        cls.python = Tag.objects.create(name='python')
+        cls.orm = Tag.objects.create(name='orm')
+        cls.baking = Tag.objects.create(name='baking')
+        cls.post = make_post(cls.author, 'Django ORM tips', cls.django, [cls.python, cls.orm])
+        cls.close = make_post(cls.author, 'More ORM tips', cls.django, [cls.python, cls.orm])
+        cls.loose = make_post(cls.author, 'Python packaging', None, [cls.python])
+        cls.unrelated = make_post(cls.author, 'Sourdough bread', cls.cooking, [cls.baking])
+
+    def setUp(self):
+        self.client = APIClient()
+        similarity.rebuild_related_posts()
+
+    def related_ids(self, post):
+        response = self.client.get(f'/api/posts/{post.pk}/related/')
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()]
+
+    def test_neighbours_are_ranked_by_shared_features(self):
+        self.assertEqual(self.related_ids(self.post), [self.close.pk, self.loose.pk])
+
+    def test_read_query_count_does_not_grow_with_results(self):
+        for i in range(6):
+            make_post(self.author, f'Django ORM recipe {i}', self.django, [self.python, self.orm])
+        similarity.rebuild_related_posts()
+        # Existence check, the indexed join, then one prefetch each for tags and likes
+        with self.assertNumQueries(4):
+            self.assertEqual(len(self.related_ids(self.post)), similarity.TOP_K - 2)
+
+    def test_unpublished_neighbours_are_not_served(self):
+        # Bulk updates skip the signals that refresh the index
+        Post.objects.filter(pk=self.close.pk).update(status='draft')
+        self.assertEqual(self.related_ids(self.post), [self.loose.pk])
+
+    @override_settings(BLOG_TASK_BROKER='eager')
+    def test_lists_that_lose_an_unpublished_post_are_refilled(self):
+        similarity.rebuild_related_posts(top_k=1)
+        self.assertEqual(self.related_ids(self.post), [self.close.pk])
+        self.close.status = 'draft'
+        self.close.save()
+        self.assertEqual(self.related_ids(self.post), [self.loose.pk])
+
+    @override_settings(BLOG_TASK_BROKER='eager')
+    def test_lists_that_lose_a_deleted_post_are_refilled(self):
+        similarity.rebuild_related_posts(top_k=1)
+        self.assertEqual(self.related_ids(self.post), [self.close.pk])
+        self.close.delete()
+        self.assertEqual(self.related_ids(self.post), [self.loose.pk])
+
+    def test_incremental_update_matches_full_rebuild(self):
+        expected = set(RelatedPost.objects.values_list('post_id', 'related_id'))
+        RelatedPost.objects.all().delete()
+        for post in Post.objects.all():
+            similarity.update_related_posts(post.pk)
+        self.assertEqual(set(RelatedPost.objects.values_list('post_id', 'related_id')), expected)
+
+    def test_incremental_update_skips_candidates_reached_only_by_common_features(self):
+        # With the cap at 2, the category (3 posts) and 'python' (3 posts) are too common
+        with mock.patch.object(similarity, 'MAX_FEATURE_DF', 2), \
+                mock.patch.object(similarity, '_published_features', wraps=similarity._published_features) as features:
+            similarity.update_related_posts(self.post.pk)
+        candidates = set(features.call_args.args[0].values_list('pk', flat=True))
+        self.assertEqual(candidates, {self.post.pk, self.close.pk})
+
+
+class TokenBucketTests(TestCase):
+    def test_burst_up_to_capacity_then_refill(self):
+        store = LocalBucketStore()
+        self.assertEqual([store.consume('k', 3, 1.0, 100.0) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(store.consume('k', 3, 1.0, 100.0), 1.0)
+        self.assertAlmostEqual(store.consume('k', 3, 1.0, 100.5), 0.5)
+        self.assertEqual(store.consume('k', 3, 1.0, 101.0), 0)
+
+    def test_prune_keeps_buckets_of_slower_scopes(self):
+        store = LocalBucketStore(shards=1, max_keys_per_shard=2)
+        # 5/hour: half drained, and only full again after 30 minutes
+        for _ in range(3):
+            store.consume('register', 5, 5 / 3600, 0.0)
+        # 10/min buckets that are full again after a few seconds trigger a prune
+        store.consume('login:a', 10, 10 / 60, 0.0)
+        store.consume('login:b', 10, 10 / 60, 60.0)
+        self.assertEqual(store.consume('register', 5, 5 / 3600, 60.0), 0)
+        self.assertEqual(store.consume('register', 5, 5 / 3600, 60.0), 0)
+        self.assertGreater(store.consume('register', 5, 5 / 3600, 60.0), 0)
+
+    def test_prune_does_not_rescan_a_shard_of_active_keys(self):
+        store = LocalBucketStore(shards=1, max_keys_per_shard=10)
+        with mock.patch.object(LocalBucketStore, '_prune', wraps=LocalBucketStore._prune) as prune:
+            for i in range(100):
+                store.consume(f'user:{i}', 5, 5 / 3600, 0.0)
+        # Pruned at 11, 23, 47 and 95 keys, not on every request past 10
+        self.assertEqual(prune.call_count, 4)
+
+
+class ThrottledEndpointTests(TestCase):
+    def setUp(self):
+        local_store.clear()
+        self.client = APIClient()
+
+    def login(self, forwarded_for):
+        return self.client.post(
+            '/api/login/', {'username': 'nobody', 'password': 'wrong'},
+            REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR=forwarded_for,
+        )
+
+    def test_forged_forwarded_for_does_not_reset_the_limit(self):
+        # The proxy appends the real client address after anything the client sent
+        statuses = [self.login(f'192.0.2.{i}, 203.0.113.7').status_code for i in range(10)]
+        self.assertEqual(statuses, [400] * 10)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.login('192.0.2.99, 203.0.113.7').status_code, 429)
+        self.assertEqual(self.login('203.0.113.8').status_code, 400)
+
+    def test_users_are_limited_separately(self):
+        user = User.objects.create_user('rater', password='secret123')
+        other = User.objects.create_user('other', password='secret123')
+        post = make_post(user, 'Rated post')
+        self.client.force_authenticate(user)
+        statuses = [self.client.post(f'/api/posts/{post.pk}/rate/', {'rating': 5}).status_code for _ in range(31)]
+        self.assertEqual(statuses, [200] * 30 + [429])
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.post(f'/api/posts/{post.pk}/rate/', {'rating': 4}).status_code, 200)
+
+    def test_safe_methods_are_not_throttled(self):
+        post = make_post(User.objects.create_user('writer', password='secret123'), 'Commented post')
+        for _ in range(25):
+            self.assertEqual(self.client.get(f'/api/posts/{post.pk}/comments/').status_code, 200)
+
+
+class AdminChangelistTests(TestCase):
+    ROWS = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret123')
+        authors = User.objects.bulk_create([User(username=f'author{i}') for i in range(50)])
+        categories = Category.objects.bulk_create([Category(name=f'category {i}') for i in range(20)])
+        tags = Tag.objects.bulk_create([Tag(name=f'tag {i}') for i in range(20)])
+        Post.objects.bulk_create([
+            Post(author=authors[i % 50], category=categories[i % 20], title=f'Post {i}', content='Bulk post content.')
+            for i in range(cls.ROWS)
+        ], batch_size=2000)
+        posts = list(Post.objects.values_list('pk', flat=True)[:cls.ROWS // 10])
+        Post.tags.through.objects.bulk_create([Post.tags.through(post_id=pk, tag=tags[pk % 20]) for pk in posts])
+        Comment.objects.bulk_create([Comment(post_id=pk, author=authors[0], content='Nice') for pk in posts])
+        PostRating.objects.bulk_create([PostRating(post_id=pk, user=authors[1], rating=4) for pk in posts])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertChangelistQueries(self, url, queries):
+        # Session and user, two paginator counts and the page, plus a date hierarchy or list filter
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_post_changelist(self):
+        response = self.assertChangelistQueries('/admin/blog/post/', 7)
+        self.assertContains(response, f'{self.ROWS} posts')
+
+    def test_post_changelist_search(self):
+        self.assertChangelistQueries('/admin/blog/post/?q=Post+99', 7)
+
+    def test_other_changelists(self):
+        self.assertChangelistQueries('/admin/blog/category/', 5)
+        self.assertChangelistQueries('/admin/blog/tag/', 5)
+        self.assertChangelistQueries('/admin/blog/comment/', 7)
+        self.assertChangelistQueries('/admin/blog/postrating/', 6)
+
+
+@override_settings(BLOG_TASK_BROKER='eager')
+class AdminBulkActionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret123')
+        cls.author = User.objects.create_user('author', password='secret123')
+        cls.reader = User.objects.create_user('reader', password='secret123')
+        Follow.objects.create(follower=cls.reader, followed=cls.author)
+        cls.python = Tag.objects.create(name='python')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.posts = [make_post(self.author, f'Python tips {i}', tags=[self.python]) for i in range(3)]
+        for post in self.posts:
+            post.publish()
+        similarity.rebuild_related_posts()
+
+    def run_action(self, action, posts, **data):
+        response = self.client.post('/admin/blog/post/', {
+            'action': action, '_selected_action': [post.pk for post in posts], **data,
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_unpublish_retracts_feeds_and_related_posts(self):
+        self.run_action('unpublish_posts', self.posts[:2])
+        self.assertEqual(Post.objects.filter(status='draft').count(), 2)
+        self.assertEqual(list(FeedEntry.objects.values_list('post_id', flat=True)), [self.posts[2].pk])
+        self.assertFalse(RelatedPost.objects.filter(post__status='draft').exists())
+        self.assertFalse(RelatedPost.objects.filter(related__status='draft').exists())
+
+    def test_publish_fans_out_and_indexes(self):
+        self.run_action('unpublish_posts', self.posts)
+        self.run_action('publish_posts', self.posts)
+        self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(), 3)
+        self.assertEqual(RelatedPost.objects.filter(post=self.posts[0]).count(), 2)
+
+    def test_retag_refreshes_related_posts_and_autocomplete(self):
+        django = Tag.objects.create(name='django')
+        tag_index.reload()
+        self.assertEqual(tag_index.search('djan'), [('django', 0)])
+        self.run_action('add_tag', self.posts[:2], tag='django')
+        self.assertEqual(tag_index.search('djan'), [('django', 2)])
+        self.assertEqual(RelatedPost.objects.filter(post=self.posts[0]).first().related, self.posts[1])
+        self.run_action('remove_tag', self.posts, tag='django')
+        self.assertEqual(tag_index.search('djan'), [('django', 0)])
+        self.assertEqual(self.posts[0].tags.count(), 1)
+
+
+@override_settings(BLOG_TASK_BROKER='eager')
+class FeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user('reader', password='secret123')
+        cls.alice = User.objects.create_user('alice', password='secret123')
+        cls.bob = User.objects.create_user('bob', password='secret123')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def follow(self, author):
+        self.assertEqual(self.client.post(f'/api/users/{author.username}/follow/').status_code, 200)
+
+    def publish(self, author, title):
+        post = make_post(author, title, status='draft')
+        post.publish()
+        return post
+
+    def feed(self, **params):
+        response = self.client.get('/api/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def feed_ids(self):
+        return [item['id'] for item in self.feed()['results']]
+
+    def test_feed_lists_followed_authors_newest_first(self):
+        self.follow(self.alice)
+        first = self.publish(self.alice, 'First')
+        self.publish(self.bob, 'Not followed')
+        second = self.publish(self.alice, 'Second')
+        self.assertEqual(self.feed_ids(), [second.pk, first.pk])
+
+    def test_fan_out_trims_timelines_past_their_length(self):
+        self.follow(self.alice)
+        with mock.patch.object(timeline, 'FEED_LENGTH', 2):
+            posts = [self.publish(self.alice, f'Post {i}') for i in range(4)]
+        self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(), 2)
+        self.assertEqual(self.feed_ids(), [posts[3].pk, posts[2].pk])
+
+    def test_cursor_pages_do_not_overlap(self):
+        self.follow(self.alice)
+        posts = [self.publish(self.alice, f'Post {i}') for i in range(7)]
+        first = self.feed(page_size=3)
+        second = self.feed(page_size=3, cursor=first['next_cursor'])
+        third = self.feed(page_size=3, cursor=second['next_cursor'])
+        ids = [item['id'] for page in (first, second, third) for item in page['results']]
+        self.assertEqual(ids, [post.pk for post in reversed(posts)])
+        self.assertIsNone(third['next_cursor'])
+
+    def test_unfollow_removes_the_authors_posts(self):
+        self.follow(self.alice)
+        self.follow(self.bob)
+        self.publish(self.alice, 'From Alice')
+        bobs = self.publish(self.bob, 'From Bob')
+        self.assertEqual(self.client.delete('/api/users/alice/follow/').status_code, 200)
+        self.assertEqual(self.feed_ids(), [bobs.pk])
+        self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(), 1)
+
+    def test_posts_unpublished_by_bulk_update_are_hidden(self):
+        self.follow(self.alice)
+        kept = self.publish(self.alice, 'Kept')
+        hidden = self.publish(self.alice, 'Hidden')
+        Post.objects.filter(pk=hidden.pk).update(status='draft')
+        self.assertEqual(self.feed_ids(), [kept.pk])
+
+    def test_follower_counts_are_maintained(self):
+        self.follow(self.alice)
+        User.objects.create_user('second', password='secret123').following.create(followed=self.alice)
+        self.assertEqual(AuthorStats.objects.get(user=self.alice).follower_count, 2)
+        self.client.delete('/api/users/alice/follow/')
+        User.objects.get(username='second').delete()
+        self.assertEqual(AuthorStats.objects.get(user=self.alice).follower_count, 0)
+
+    def test_popular_authors_are_merged_in_at_read_time(self):
+        self.follow(self.alice)
+        self.follow(self.bob)
+        with mock.patch.object(timeline, 'FANOUT_FOLLOWER_LIMIT', 0):
+            popular = self.publish(self.alice, 'Popular')
+            fanned = self.publish(self.bob, 'Also popular')
+            # Neither post was fanned out; the read takes the timeline, the
+            # followed authors above the limit, their posts and the page
+            self.assertFalse(FeedEntry.objects.exists())
+            with self.assertNumQueries(4):
+                posts, _ = timeline.read_feed(self.reader.pk)
+        self.assertEqual([post.pk for post in posts], [fanned.pk, popular.pk])
+
+
+class StartupTimeTests(SimpleTestCase):
+    def test_cold_start_stays_within_budget(self):
+        for target in ('manage', 'wsgi'):
+            # CPU time rather than wall time, and the best of three runs, so a busy machine does not fail the build
+            cpu_ms = min(startup_cpu_ms(target) for _ in range(3))
+            self.assertLess(cpu_ms, STARTUP_BUDGET_MS, f"{target} cold start took {cpu_ms:.0f} ms of CPU time")
+
+    def test_rarely_used_modules_are_not_imported_at_startup(self):
+        _, rows = profile_startup('wsgi')
+        imported = {name for name, _, _, _ in rows}
+        self.assertIn('blog.views', imported)
+        for module in ('blog.syndication', 'blog.revisions', 'blog.similarity', 'concurrent.futures.process'):
+            self.assertNotIn(module, imported)
+
+
+class RevisionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('writer', password='secret123')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.post = make_post(self.author, 'Revised', content='Original content of the post.')
+
+    def edit(self, content, **extra):
+        return self.client.patch(f'/api/posts/{self.post.pk}/', {'content': content, **extra}, format='json')
+
+    def history(self):
+        numbers = PostRevision.objects.filter(post=self.post).values_list('number', flat=True)
+        return [revisions.revision_content(self.post.pk, number) for number in numbers]
+
+    def test_every_edit_is_retrievable(self):
+        versions = [f'Edit number {i} of the post, word {i}.' for i in range(revisions.SNAPSHOT_INTERVAL + 5)]
+        for content in versions:
+            self.assertEqual(self.edit(content).status_code, 200)
+        self.assertEqual(self.history(), ['Original content of the post.'] + versions)
+        response = self.client.get(f'/api/posts/{self.post.pk}/revisions/3/')
+        self.assertEqual(response.json()['content'], versions[1])
+
+    def test_unchanged_content_records_nothing(self):
+        self.assertEqual(self.edit('Original content of the post.').status_code, 200)
+        self.assertEqual(self.client.patch(f'/api/posts/{self.post.pk}/', {'title': 'Renamed'}).status_code, 200)
+        self.assertFalse(PostRevision.objects.exists())
+
+    def test_delta_is_taken_against_the_last_stored_revision(self):
+        self.edit('Second version of the post.')
+        # A caller holding content older than the last revision must not corrupt the chain
+        self.post.refresh_from_db()
+        self.post.content = 'Third version of the post.'
+        revisions.record_revision(self.post, 'Original content of the post.')
+        self.assertEqual(self.history(), [
+            'Original content of the post.', 'Second version of the post.', 'Third version of the post.',
+        ])
+
+    def test_stale_read_with_current_version_diffs_against_stored_content(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        self.edit('Someone else edited this post.')
+        with mock.patch.object(Post.objects, 'get', return_value=stale):
+            response = self.edit('My edit of the post.', version=stale.version + 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.history(), [
+            'Original content of the post.', 'Someone else edited this post.', 'My edit of the post.',
+        ])
+
+    def test_failed_edit_records_no_revision(self):
+        response = self.edit('Edit against an old version.', version=self.post.version - 1)
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(PostRevision.objects.exists())
+
+    def test_lost_race_for_the_revision_number_is_retried(self):
+        self.edit('Second version of the post.')
+        self.post.refresh_from_db()
+        self.post.content = 'Third version of the post.'
+        # The first attempt sees a Max() from before a concurrent insert
+        with mock.patch.object(revisions, '_last_number', side_effect=[1, 2]):
+            revision = revisions.record_revision(self.post, 'Second version of the post.')
+        self.assertEqual(revision.number, 3)
+        self.assertEqual(self.history()[-1], 'Third version of the post.')
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def slow_index(self, rows):
+        """An index whose loads, after the first, block until ``release`` is set."""
+        self.loading, self.release = threading.Event(), threading.Event()
+        loads = []
+
+        def loader():
+            if loads:
+                self.loading.set()
+                self.release.wait(5)
+            loads.append(1)
+            return list(rows)
+
+        index = PrefixIndex(loader)
+        index.reload()
+        return index
+
+    def reload_in_background(self, index):
+        index.invalidate()
+        # The stale index answers at once and reloads on another thread
+        self.assertEqual(index.search('x'), [])
+        self.assertTrue(self.loading.wait(5))
+        return index.reloader
+
+    def test_search_ranks_by_usage(self):
+        index = PrefixIndex(lambda: [(1, 'Django', 3), (2, 'django-rest', 7), (3, 'flask', 9)])
+        self.assertEqual(index.search('DJ'), [('django-rest', 7), ('Django', 3)])
+        self.assertEqual(index.search('dj', limit=1), [('django-rest', 7)])
+
+    def test_searches_are_answered_while_another_thread_reloads(self):
+        rows = [(1, 'django', 1)]
+        index = self.slow_index(rows)
+        thread = self.reload_in_background(index)
+        try:
+            # Would deadlock for five seconds if the load held the index lock
+            self.assertEqual(index.search('dj'), [('django', 1)])
+            self.assertFalse(self.release.is_set())
+        finally:
+            self.release.set()
+            thread.join()
+
+    def test_changes_made_during_a_reload_survive_the_swap(self):
+        index = self.slow_index([(1, 'django', 1), (2, 'flask', 1)])
+        thread = self.reload_in_background(index)
+        index.put(3, 'djangocon')
+        index.remove(2)
+        self.release.set()
+        thread.join()
+        self.assertEqual(index.search('djangocon'), [('djangocon', 0)])
+        self.assertEqual(index.search('fl'), [])
+
+
+class CategoryCountTests(TestCase):
+    def test_post_changes_adjust_category_counts_without_a_reload(self):
+        author = User.objects.create_user('counted', password='secret123')
+        python, rust = Category.objects.create(name='Python'), Category.objects.create(name='Rust')
+        category_index.reload()
+        loaded_at = category_index.loaded_at
+        post = make_post(author, 'Counted', category=python)
+        make_post(author, 'Also counted', category=python)
+        self.assertEqual(category_index.search('py'), [('Python', 2)])
+        post.category = rust
+        post.save()
+        post.save(update_fields=['title'])
+        self.assertEqual(category_index.search('py'), [('Python', 1)])
+        rust.name = 'Rustlang'
+        rust.save()
+        self.assertEqual(category_index.search('rust'), [('Rustlang', 1)])
+        post.delete()
+        self.assertEqual(category_index.search('rust'), [('Rustlang', 0)])
+        self.assertEqual(category_index.loaded_at, loaded_at)
+
+
+class PostEditTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('editor', password='secret123')
+        cls.fan = User.objects.create_user('fan', password='secret123')
+        cls.category = Category.objects.create(name='Python')
+        cls.tag = Tag.objects.create(name='django')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.addCleanup(viewcounts.view_buffer.clear)
+        self.post = make_post(self.author, 'Edited', category=self.category)
+        self.post.likes.add(self.fan)
+
+    def test_put_of_a_read_post_succeeds_and_keeps_likes(self):
+        body = self.client.get(f'/api/posts/{self.post.pk}/').json()
+        body.update(title='Renamed', category='Python', tags=['django'], likes=[self.author.pk])
+        response = self.client.put(f'/api/posts/{self.post.pk}/', body, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.title, 'Renamed')
+        self.assertEqual(list(self.post.tags.values_list('name', flat=True)), ['django'])
+        self.assertEqual(list(self.post.likes.all()), [self.fan])
+        self.assertEqual(self.post.version, 2)
+
+    def test_only_changed_columns_are_written(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/posts/{self.post.pk}/', {'title': 'Renamed', 'tags': ['django']}, format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "blog_post"')]
+        self.assertEqual(len(updates), 2)  # The version claim and the save
+        self.assertIn('SET "title"', updates[1])
+        self.assertNotIn('"content"', updates[1])
+
+
+class ConcurrentEditTests(TransactionTestCase):
+    writers = 8
+
+    def setUp(self):
+        self.addCleanup(viewcounts.view_buffer.clear)
+
+    def test_one_of_many_concurrent_edits_of_a_version_wins(self):
+        author = User.objects.create_user('editor', password='secret123')
+        post = make_post(author, 'Contended')
+        start = threading.Barrier(self.writers)
+        # sqlite's shared in-memory test database fails concurrent writers
+        # instead of making them wait, so there the writes take turns; the
+        # reads still all happen before any of them
+        write_lock = threading.Lock() if connection.vendor == 'sqlite' else contextlib.nullcontext()
+        statuses = []
+
+        def edit(i):
+            try:
+                client = APIClient()
+                client.force_authenticate(author)
+                version = client.get(f'/api/posts/{post.pk}/').json()['version']
+                start.wait(5)
+                with write_lock:
+                    response = client.patch(
+                        f'/api/posts/{post.pk}/', {'content': f'Edit from writer {i}.', 'version': version}, format='json',
+                    )
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=edit, args=(i,)) for i in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [200] + [409] * (self.writers - 1))
+        post.refresh_from_db()
+        self.assertEqual(post.version, 2)
+        self.assertEqual(PostRevision.objects.filter(post=post).count(), 2)
+
+
+class SyndicationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('syndicated', password='secret123')
+        cls.python = Tag.objects.create(name='python')
+        cls.rust = Tag.objects.create(name='rust')
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(SYNDICATION_ROOT=root.name, SITE_URL='http://testserver')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(viewcounts.view_buffer.clear)
+
+    def test_sitemap_and_feed_links_are_public(self):
+        post = make_post(self.author, 'Crawled', tags=[self.python])
+        make_post(self.author, 'Unlisted draft', status='draft')
+        syndication.build_sitemaps()
+        sitemap = b''.join(self.client.get('/sitemap-0.xml').streaming_content).decode()
+        feed = b''.join(self.client.get('/feeds/tag/python/').streaming_content).decode()
+        links = set(re.findall(r'<loc>http://testserver(.*?)</loc>', sitemap))
+        links |= set(re.findall(r'<link href="http://testserver(/api/posts/.*?)"', feed))
+        self.assertEqual(links, {f'/api/posts/{post.pk}/'})
+        for link in links:
+            # Crawlers are anonymous
+            self.assertEqual(self.client.get(link).status_code, 200)
+
+    def test_anonymous_readers_cannot_see_drafts_or_edit(self):
+        draft = make_post(self.author, 'Draft', status='draft')
+        published = make_post(self.author, 'Published')
+        self.assertEqual(self.client.get(f'/api/posts/{draft.pk}/').status_code, 403)
+        self.assertEqual(self.client.patch(f'/api/posts/{published.pk}/', {'title': 'Defaced'}).status_code, 401)
+
+    def test_retagging_regenerates_the_tag_feed(self):
+        post = make_post(self.author, 'Retagged', tags=[self.python])
+        other = make_post(self.author, 'Moved', tags=[self.rust])
+        Post.objects.update(updated_at=post.updated_at)
+        first = syndication.build_feed('tag', 'python', 'http://testserver/feeds/tag/python/').read_text()
+        # Same post count and update times, different posts
+        post.tags.set([self.rust])
+        other.tags.set([self.python])
+        second = syndication.build_feed('tag', 'python', 'http://testserver/feeds/tag/python/').read_text()
+        self.assertIn('Retagged', first)
+        self.assertNotIn('Retagged', second)
+        self.assertIn('Moved', second)
+
+    def test_missing_sitemap_is_queued_not_built_in_the_request(self):
+        make_post(self.author, 'Crawled')
+        with mock.patch.object(syndication, 'build_sitemaps') as build:
+            response = self.client.get('/sitemap.xml')
+            self.client.get('/sitemap.xml')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '600')
+        build.assert_not_called()
+        self.assertEqual(Task.objects.filter(name='blog.tasks.rebuild_sitemaps').count(), 1)
+
+        syndication.build_sitemaps()
+        self.assertEqual(self.client.get('/sitemap.xml').status_code, 200)
+
+
+calls = []
+
+
+@taskqueue.task(max_attempts=3)
+def flaky_task(fail_times):
+    calls.append(fail_times)
+    if len(calls) <= fail_times:
+        raise RuntimeError("flaky")
+
+
+@taskqueue.task()
+def write_pid(path):
+    with open(path, 'a') as out:
+        out.write(f'{os.getpid()}\n')
+
+
+@taskqueue.task(max_attempts=1)
+def always_fails():
+    raise RuntimeError("broken")
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def brokers(self):
+        return [taskqueue.MemoryBroker(), taskqueue.DatabaseBroker()]
+
+    def test_duplicate_enqueues_are_dropped_until_claimed(self):
+        for broker in self.brokers():
+            with self.subTest(broker=type(broker).__name__):
+                self.assertIsNotNone(broker.enqueue(flaky_task.task_name, [0], dedup_key='key'))
+                self.assertIsNone(broker.enqueue(flaky_task.task_name, [0], dedup_key='key'))
+                broker.enqueue_many(flaky_task.task_name, [[0], [0]], ['key', 'other'])
+                self.assertEqual(broker.pending_count(), 2)
+                # Once a worker holds the task, a change needs a fresh run
+                self.assertEqual(len(broker.claim(1)), 1)
+                self.assertIsNotNone(broker.enqueue(flaky_task.task_name, [0], dedup_key='key'))
+                Task.objects.all().delete()
+
+    def test_failed_tasks_back_off_then_give_up(self):
+        for broker in self.brokers():
+            with self.subTest(broker=type(broker).__name__):
+                calls.clear()
+                broker.enqueue(flaky_task.task_name, [5])
+                started = now()
+                for attempt in range(1, 4):
+                    with mock.patch.object(taskqueue, 'now', return_value=started + timedelta(hours=attempt)):
+                        self.assertEqual(taskqueue.run_pending(broker), 1)
+                        # Not retried before its backoff has passed
+                        self.assertEqual(taskqueue.run_pending(broker), 0)
+                self.assertEqual(len(calls), 3)
+                self.assertEqual(broker.pending_count(), 0)
+                Task.objects.all().delete()
+
+    def test_retried_task_succeeds(self):
+        broker = taskqueue.MemoryBroker()
+        broker.enqueue(flaky_task.task_name, [1])
+        taskqueue.run_pending(broker)
+        job = next(iter(broker.jobs.values()))
+        self.assertEqual(job.attempts, 1)
+        self.assertAlmostEqual((job.run_after - now()).total_seconds(), taskqueue.backoff(1).total_seconds(), delta=1)
+        with mock.patch.object(taskqueue, 'now', return_value=job.run_after):
+            taskqueue.run_pending(broker)
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual((broker.pending_count(), broker.failed), (0, []))
+
+    def test_worker_runs_tasks_in_separate_processes(self):
+        broker = taskqueue.MemoryBroker()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'pids')
+            broker.enqueue_many(write_pid.task_name, [[path]] * 6, [None] * 6)
+            broker.enqueue(always_fails.task_name, [], max_attempts=1)
+            self.assertEqual(taskqueue.run_worker(broker, processes=2, once=True), 7)
+            with open(path) as pids:
+                pids = {int(pid) for pid in pids.read().split()}
+        self.assertTrue(pids)
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(broker.pending_count(), 0)
+        self.assertEqual([job.name for job, error in broker.failed], [always_fails.task_name])
+        # The parent's database session survives the pool
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+
+    @override_settings(BLOG_TASK_BROKER='memory')
+    def test_rating_returns_the_current_average_without_a_worker(self):
+        author = User.objects.create_user('rated', password='secret123')
+        post = make_post(author, 'Rated')
+        PostRating.objects.create(post=post, user=author, rating=2)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('rater', password='secret123'))
+        response = client.post(f'/api/posts/{post.pk}/rate/', {'rating': 5})
+        self.assertEqual(response.json()['average_rating'], 3.5)
+        post.refresh_from_db()
+        self.assertEqual(post.average_rating, 0.0)  # Stored by the worker
+
+        taskqueue.run_pending()
+        post.refresh_from_db()
+        self.assertEqual(post.average_rating, 3.5)
+
+
+class StreamedPostListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('prolific', password='secret123')
+        cls.fans = User.objects.bulk_create([User(username=f'fan{i}') for i in range(50)])
+        cls.python = Tag.objects.create(name='python')
+        cls.django = Tag.objects.create(name='python-django')
+
+    def add_posts(self, count):
+        posts = Post.objects.bulk_create([
+            Post(author=self.author, title=f'Post {i}', content='Streamed post content.', status='published')
+            for i in range(count)
+        ])
+        Post.likes.through.objects.bulk_create(
+            [Post.likes.through(post_id=post.pk, user_id=fan.pk) for post in posts for fan in self.fans[:5]]
+        )
+        return posts
+
+    def stream(self, url):
+        return b''.join(self.client.get(url).streaming_content)
+
+    def test_likers_are_listed_as_bare_ids(self):
+        post = self.add_posts(1)[0]
+        post.tags.set([self.python, self.django])
+        with CaptureQueriesContext(connection) as queries:
+            items = json.loads(self.stream('/api/posts/tag/python/'))
+        # One row per post even though two of its tags match
+        self.assertEqual([(item['id'], item['likes_count']) for item in items], [(post.pk, 5)])
+        self.assertEqual(sorted(items[0]['likes']), [fan.pk for fan in self.fans[:5]])
+        self.assertFalse([query for query in queries if 'auth_user"."password' in query['sql'] and 'blog_post_likes' in query['sql']])
+
+    def test_peak_memory_does_not_grow_with_the_result(self):
+        def peak(count):
+            self.add_posts(count)
+            gc.collect()
+            tracemalloc.start()
+            try:
+                response = self.client.get('/api/posts/author/prolific/')
+                streamed = sum(len(chunk) for chunk in response.streaming_content)
+                self.assertGreater(streamed, count * 100)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        peak(10)  # Modules imported on the first request are not part of the comparison
+        small = peak(1000)
+        large = peak(19000)  # 20,000 posts in total
+        self.assertLess(large, small * 1.25)
+
+
+class HyperLogLogTests(SimpleTestCase):
+    def test_estimates_stay_within_a_few_standard_errors(self):
+        # 1.04 / sqrt(1024) is about 3.3% standard error
+        for distinct in (10, 100, 1000, 10000, 100000):
+            sketch = viewcounts.HyperLogLog()
+            for i in range(distinct):
+                sketch.add(f'user:{i}')
+                sketch.add(f'user:{i}')  # Repeat views do not count
+            self.assertAlmostEqual(sketch.count(), distinct, delta=max(1, distinct * 0.1), msg=distinct)
+
+    def test_merge_counts_the_union(self):
+        first, second = viewcounts.HyperLogLog(), viewcounts.HyperLogLog()
+        for i in range(6000):
+            first.add(f'user:{i}')
+        for i in range(4000, 10000):
+            second.add(f'user:{i}')
+        expected = bytearray(map(max, first.registers, second.registers))
+        first.merge(second)
+        self.assertEqual(first.registers, expected)
+        self.assertAlmostEqual(first.count(), 10000, delta=1000)
+
+    def test_merge_takes_the_larger_register_at_the_extremes(self):
+        first = viewcounts.HyperLogLog(bytes([0, 55, 55, 1, 0, 64, 2, 0]), precision=3)
+        second = viewcounts.HyperLogLog(bytes([55, 0, 55, 0, 1, 63, 3, 0]), precision=3)
+        first.merge(second)
+        self.assertEqual(first.registers, bytearray([55, 55, 55, 1, 1, 64, 3, 0]))
+
+
+class ViewBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = make_post(User.objects.create_user('viewed', password='secret123'), 'Viewed')
+
+    def test_threads_spread_over_the_shards(self):
+        buffer = viewcounts.ViewBuffer(shards=4, flush_interval=None)
+        threads = [threading.Thread(target=buffer.record, args=(self.post.pk,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+            thread.join()  # One at a time, so that idents may be reused as they are in a thread pool
+        self.assertEqual([hits[self.post.pk] for _, hits, _ in buffer._shards], [2, 2, 2, 2])
+
+    def test_concurrently_inserted_first_sketch_is_merged_not_dropped(self):
+        buffer = viewcounts.ViewBuffer(flush_interval=None)
+        buffer.record(self.post.pk, viewer='user:1')
+        create = PostDailyViewers.objects.bulk_create
+
+        def other_worker_first(objs, **kwargs):
+            # Another process flushes its first sketch of the day after this one looked for the row
+            other = viewcounts.HyperLogLog()
+            other.add('user:2')
+            PostDailyViewers.objects.create(post=self.post, day=objs[0].day, sketch=bytes(other.registers))
+            return create(objs, **kwargs)
+
+        with mock.patch.object(PostDailyViewers.objects, 'bulk_create', side_effect=other_worker_first):
+            buffer.flush()
+        self.assertEqual(viewcounts.unique_viewers(self.post.pk), 2)
+
+    def test_failed_writes_are_retried_by_the_next_flush(self):
+        buffer = viewcounts.ViewBuffer(flush_interval=None)
+        for viewer in ('user:1', 'user:2', 'user:1'):
+            buffer.record(self.post.pk, viewer=viewer)
+        with mock.patch.object(viewcounts, '_write_hits', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                buffer.flush()
+        buffer.record(self.post.pk, viewer='user:3')
+        with mock.patch.object(viewcounts, '_write_sketches', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 4)
+
+        self.assertEqual(buffer.flush(), 0)  # The hits were written; only the sketches were pending
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 4)
+        self.assertEqual(viewcounts.unique_viewers(self.post.pk), 3)
+
+    def test_failed_background_flush_is_logged_and_retried(self):
+        buffer = viewcounts.ViewBuffer(flush_interval=None)
+        buffer.record(self.post.pk)
+        with mock.patch.object(viewcounts, '_write_hits', side_effect=DatabaseError):
+            with self.assertLogs('blog.viewcounts', 'ERROR'):
+                self.assertEqual(buffer.flush_logging_errors(), 0)
+        self.assertEqual(buffer.flush_logging_errors(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 1)
+
+    def test_reading_a_post_never_flushes_in_the_request(self):
+        self.addCleanup(viewcounts.view_buffer.clear)
+        # Even with a flush long overdue
+        with mock.patch.object(viewcounts, 'FLUSH_SECONDS', 0), \
+                mock.patch.object(viewcounts.view_buffer, 'flush', side_effect=DatabaseError) as flush:
+            for _ in range(3):
+                self.assertEqual(APIClient().get(f'/api/posts/{self.post.pk}/').status_code, 200)
+        flush.assert_not_called()
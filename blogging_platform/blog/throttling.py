@@ -0,0 +1,155 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+
+class LocalBucketStore:
+    """In-process token buckets, sharded so that unrelated keys rarely share a lock."""
+
+    def __init__(self, shards=64, max_keys_per_shard=10000):
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        self.max_keys_per_shard = max_keys_per_shard
+        self._prune_at = [max_keys_per_shard] * shards  # Shard size that triggers the next prune
+
+    def consume(self, key, capacity, refill_rate, now):
+        """Take one token from the bucket; return the seconds to wait, or 0 if allowed."""
+        index = hash(key) % len(self._shards)
+        buckets, lock = self._shards[index]
+        with lock:
+            tokens, stamp, _ = buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - stamp) * refill_rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / refill_rate
+            # Each bucket remembers when it will be full again, since scopes refill at different rates
+            buckets[key] = (tokens, now, now + (capacity - tokens) / refill_rate)
+            if len(buckets) > self._prune_at[index]:
+                self._prune(buckets, now)
+                # If most keys are still active, wait for the shard to double
+                # before scanning again rather than rescanning on every request
+                self._prune_at[index] = max(self.max_keys_per_shard, 2 * len(buckets))
+        return wait
+
+    @staticmethod
+    def _prune(buckets, now):
+        # A bucket past its refill time is back at capacity, so forgetting it
+        # does not change any future decision.
+        for key in [key for key, (_, _, full_at) in buckets.items() if full_at <= now]:
+            del buckets[key]
+
+    def clear(self):
+        for index, (buckets, lock) in enumerate(self._shards):
+            with lock:
+                buckets.clear()
+                self._prune_at[index] = self.max_keys_per_shard
+
+
+class CacheBucketStore:
+    """Token buckets kept in a Django cache so limits are shared between workers.
+
+    Reads and writes are not atomic, so a burst racing across workers may be
+    let through slightly over the limit; that is acceptable for abuse throttling.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def consume(self, key, capacity, refill_rate, now):
+        tokens, stamp = self.cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - stamp) * refill_rate)
+        timeout = int(capacity / refill_rate) + 1
+        if tokens >= 1:
+            self.cache.set(key, (tokens - 1, now), timeout)
+            return 0
+        self.cache.set(key, (tokens, now), timeout)
+        return (1 - tokens) / refill_rate
+
+    def clear(self):
+        self.cache.clear()
+
+
+local_store = LocalBucketStore()
+
+
+def get_bucket_store():
+    """Use the cache named by BLOG_THROTTLE_CACHE if set, else the in-process store."""
+    alias = getattr(settings, 'BLOG_THROTTLE_CACHE', None)
+    if alias:
+        return CacheBucketStore(alias)
+    return local_store
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token-bucket throttle for write endpoints.
+
+    The rate for ``scope`` is read from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']
+    in the usual DRF "<requests>/<period>" form; the request count is also the
+    bucket size, so clients may burst up to it and then refill at the average
+    rate. Buckets are keyed per user, or per client IP for anonymous requests;
+    the IP is read as configured by REST_FRAMEWORK['NUM_PROXIES'], so clients
+    cannot pick their own key with a forged X-Forwarded-For header.
+    Safe methods are never throttled.
+    """
+    scope = None
+    timer = time.time  # Wall clock, so timestamps stay comparable across workers
+    durations = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self):
+        self.wait_time = 0
+
+    def get_rate(self):
+        rates = getattr(settings, 'REST_FRAMEWORK', {}).get('DEFAULT_THROTTLE_RATES', {})
+        return rates.get(self.scope)
+
+    def parse_rate(self, rate):
+        num, period = rate.split('/')
+        return int(num), self.durations[period[0]]
+
+    def get_cache_key(self, request):
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        return f'throttle:{self.scope}:{ident}'
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS:
+            return True
+        rate = self.get_rate()
+        if rate is None:
+            return True
+        capacity, period = self.parse_rate(rate)
+        self.wait_time = get_bucket_store().consume(
+            self.get_cache_key(request), capacity, capacity / period, self.timer()
+        )
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
+
+
+class LoginThrottle(TokenBucketThrottle):
+    scope = 'login'
+
+
+class RegisterThrottle(TokenBucketThrottle):
+    scope = 'register'
+
+
+class LikeThrottle(TokenBucketThrottle):
+    scope = 'like'
+
+
+class RateThrottle(TokenBucketThrottle):
+    scope = 'rate'
+
+
+class CommentThrottle(TokenBucketThrottle):
+    scope = 'comment'
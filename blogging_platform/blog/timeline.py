@@ -0,0 +1,162 @@
+import base64
+import heapq
+from datetime import datetime
+
+from django.db.models import Count, F, Q
+
+from .models import AuthorStats, FeedEntry, Follow, Post
+from .tasks import trim_feeds
+
+# Entries kept per user; older ones are trimmed
+FEED_LENGTH = 500
+
+# Authors with more followers than this are not fanned out on publish; their
+# posts are merged into followers' feeds at read time instead
+FANOUT_FOLLOWER_LIMIT = 5000
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def adjust_follower_count(author_id, delta):
+    updated = AuthorStats.objects.filter(user_id=author_id).update(follower_count=F('follower_count') + delta)
+    if not updated and delta > 0:
+        # First follow of this author; the new Follow row is already counted
+        AuthorStats.objects.get_or_create(
+            user_id=author_id, defaults={'follower_count': Follow.objects.filter(followed_id=author_id).count()},
+        )
+
+
+def is_fanout_author(author_id):
+    count = AuthorStats.objects.filter(user_id=author_id).values_list('follower_count', flat=True).first()
+    return (count or 0) <= FANOUT_FOLLOWER_LIMIT
+
+
+def fan_out_post(post):
+    """Push a newly published post into the timelines of its author's followers.
+
+    Returns the number of timelines written to (0 for authors served on read).
+    Each batch of followers queues a task trimming those timelines that grew
+    past FEED_LENGTH.
+    """
+    if post.status != 'published' or not is_fanout_author(post.author_id):
+        return 0
+    published_at = post.published_at or post.created_at
+    follower_ids = Follow.objects.filter(followed_id=post.author_id).values_list('follower_id', flat=True)
+    written = 0
+    batch = []
+    for follower_id in follower_ids.iterator(chunk_size=FANOUT_BATCH_SIZE):
+        batch.append(FeedEntry(user_id=follower_id, post_id=post.pk, published_at=published_at))
+        if len(batch) >= FANOUT_BATCH_SIZE:
+            _write_feed_entries(batch)
+            written += len(batch)
+            batch = []
+    _write_feed_entries(batch)
+    return written + len(batch)
+
+
+def _write_feed_entries(entries):
+    if not entries:
+        return
+    FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    trim_feeds.enqueue([entry.user_id for entry in entries])
+
+
+def retract_post(post):
+    """Remove an unpublished post from every timeline."""
+    FeedEntry.objects.filter(post_id=post.pk).delete()
+
+
+def retract_posts(post_ids):
+    """Remove several unpublished posts from every timeline."""
+    FeedEntry.objects.filter(post_id__in=list(post_ids)).delete()
+
+
+def remove_author_from_feed(user_id, author_id):
+    """Drop an unfollowed author's posts from a user's timeline."""
+    FeedEntry.objects.filter(user_id=user_id, post__author_id=author_id).delete()
+
+
+def trim_feed(user_id, length=FEED_LENGTH):
+    """Delete a user's timeline entries beyond the newest ``length``."""
+    cutoff = (
+        FeedEntry.objects.filter(user_id=user_id)
+        .order_by('-published_at', '-post_id')
+        .values_list('published_at', 'post_id')[length:length + 1]
+    )
+    cutoff = list(cutoff)
+    if not cutoff:
+        return 0
+    published_at, post_id = cutoff[0]
+    deleted, _ = FeedEntry.objects.filter(user_id=user_id).filter(
+        Q(published_at__lt=published_at) | Q(published_at=published_at, post_id__lte=post_id)
+    ).delete()
+    return deleted
+
+
+def trim_oversized_feeds(user_ids=None, length=None):
+    """Trim the timelines, of ``user_ids`` or of every user, holding more than ``length`` (FEED_LENGTH) entries."""
+    length = FEED_LENGTH if length is None else length
+    entries = FeedEntry.objects.all() if user_ids is None else FeedEntry.objects.filter(user_id__in=list(user_ids))
+    oversized = (
+        entries.values('user_id').annotate(entries=Count('id'))
+        .filter(entries__gt=length).values_list('user_id', flat=True)
+    )
+    return sum(trim_feed(user_id, length) for user_id in oversized)
+
+
+def encode_cursor(published_at, post_id):
+    raw = f"{published_at.isoformat()}|{post_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """Return (published_at, post_id) from a cursor, raising ValueError if malformed."""
+    try:
+        published_at, post_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(published_at), int(post_id)
+    except (TypeError, UnicodeDecodeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def _before(cursor, time_field, id_field):
+    published_at, post_id = cursor
+    return Q(**{f'{time_field}__lt': published_at}) | Q(**{time_field: published_at, f'{id_field}__lt': post_id})
+
+
+def read_feed(user_id, cursor=None, limit=20):
+    """Return (posts, next_cursor) for a page of the user's feed, newest first.
+
+    Fanned-out entries come from the user's timeline; posts by followed authors
+    above FANOUT_FOLLOWER_LIMIT are read directly and merged in.
+    """
+    # Entries of posts unpublished by a bulk update may linger until retracted
+    entries = FeedEntry.objects.filter(user_id=user_id, post__status='published')
+    if cursor is not None:
+        entries = entries.filter(_before(cursor, 'published_at', 'post_id'))
+    stored = list(entries.order_by('-published_at', '-post_id').values_list('published_at', 'post_id')[:limit + 1])
+
+    pulled_author_ids = list(
+        Follow.objects.filter(follower_id=user_id, followed__author_stats__follower_count__gt=FANOUT_FOLLOWER_LIMIT)
+        .values_list('followed_id', flat=True)
+    )
+    pulled = []
+    if pulled_author_ids:
+        posts = Post.objects.filter(author_id__in=pulled_author_ids, status='published', published_at__isnull=False)
+        if cursor is not None:
+            posts = posts.filter(_before(cursor, 'published_at', 'id'))
+        pulled = list(posts.order_by('-published_at', '-id').values_list('published_at', 'id')[:limit + 1])
+
+    page = []
+    seen = set()
+    for published_at, post_id in heapq.merge(stored, pulled, reverse=True):
+        # An author who crossed the fan-out limit can have posts in both sources
+        if post_id not in seen:
+            seen.add(post_id)
+            page.append((published_at, post_id))
+        if len(page) > limit:
+            break
+    next_cursor = encode_cursor(*page[limit - 1]) if len(page) > limit else None
+    page = page[:limit]
+
+    posts_by_id = Post.objects.filter(status='published').select_related('author', 'category').in_bulk([post_id for _, post_id in page])
+    return [posts_by_id[post_id] for _, post_id in page if post_id in posts_by_id], next_cursor
@@ -15,6 +15,19 @@ from .views import (
     update_or_delete_comment,
     like_post,
     rate_post, 
+    related_posts,
+    follow_user,
+    user_feed,
+    post_revisions,
+    post_revision_detail,
+    autocomplete_tags,
+    autocomplete_categories,
+    sitemap_index,
+    sitemap_section,
+    category_feed,
+    author_feed,
+    tag_feed,
+    post_view_stats,
 )
 
 urlpatterns = [
@@ -33,6 +46,21 @@ urlpatterns = [
     path('api/comments/<int:comment_id>/', update_or_delete_comment, name='comment-detail'), 
     path('api/posts/<int:post_id>/like/', like_post, name='like-post'),
     path('api/posts/<int:post_id>/rate/', rate_post, name='rate-post'),
+    path('api/posts/<int:post_id>/related/', related_posts, name='related-posts'),
+    path('api/users/<str:username>/follow/', follow_user, name='follow-user'),
+    path('api/feed/', user_feed, name='user-feed'),
+    path('api/posts/<int:id>/revisions/', post_revisions, name='post-revisions'),
+    path('api/posts/<int:id>/revisions/<int:number>/', post_revision_detail, name='post-revision-detail'),
+    path('api/posts/<int:id>/views/', post_view_stats, name='post-view-stats'),
+    path('api/autocomplete/tags/', autocomplete_tags, name='autocomplete-tags'),
+    path('api/autocomplete/categories/', autocomplete_categories, name='autocomplete-categories'),
+
+    # Sitemaps and Atom Feeds
+    path('sitemap.xml', sitemap_index, name='sitemap-index'),
+    path('sitemap-<int:number>.xml', sitemap_section, name='sitemap-section'),
+    path('feeds/category/<str:category_name>/', category_feed, name='category-feed'),
+    path('feeds/author/<str:author_username>/', author_feed, name='author-feed'),
+    path('feeds/tag/<str:tag_name>/', tag_feed, name='tag-feed'),
 
     # Template Endpoints
     path('create-post/', TemplateView.as_view(template_name='create_post.html'), name='create-post'),
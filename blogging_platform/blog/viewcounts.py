@@ -0,0 +1,248 @@
+import atexit
+import functools
+import hashlib
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, When
+from django.utils.timezone import localdate
+
+from .models import Post, PostDailyViewers
+
+logger = logging.getLogger(__name__)
+
+# Hits are buffered in memory and written by a background thread this often per process
+FLUSH_SECONDS = 10
+
+# Independent buffers; concurrent requests usually land on different ones
+SHARDS = 16
+
+FLUSH_BATCH_SIZE = 500
+
+# HyperLogLog precision: 2 ** 10 one-byte registers, about 3% standard error
+HLL_PRECISION = 10
+
+
+@functools.lru_cache(maxsize=None)
+def _high_bits(size):
+    return int.from_bytes(b'\x80' * size, 'big')
+
+
+class HyperLogLog:
+    """Fixed-size estimator of the number of distinct keys added."""
+
+    def __init__(self, registers=None, precision=HLL_PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    def add(self, key):
+        value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        # Byte-wise max computed on the registers as one big integer: ranks
+        # never exceed 64, so (a | 0x80) - b leaves each byte's top bit set
+        # exactly where a >= b, with no borrow between bytes
+        a = int.from_bytes(self.registers, 'big')
+        b = int.from_bytes(other.registers, 'big')
+        high = _high_bits(self.size)
+        a_wins = (((a | high) - b) & high) >> 7
+        mask = (a_wins << 8) - a_wins  # 0xff in each byte where a >= b
+        self.registers = bytearray(((a & mask) | (b & ~mask)).to_bytes(self.size, 'big'))
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -register for register in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * self.size and empty:
+            # Linear counting is more accurate while many registers are unset
+            return round(self.size * math.log(self.size / empty))
+        return round(estimate)
+
+
+class ViewBuffer:
+    """Sharded in-process counters of post views and viewer sketches.
+
+    Unless ``flush_interval`` is None, the first recorded view starts a daemon
+    thread that flushes every ``flush_interval`` seconds, so requests never
+    wait for (or fail with) a write.
+    """
+
+    def __init__(self, shards=SHARDS, flush_interval=FLUSH_SECONDS):
+        self._shards = [(threading.Lock(), Counter(), {}) for _ in range(shards)]
+        self._flush_lock = threading.Lock()
+        self.flush_interval = flush_interval
+        self._flusher_lock = threading.Lock()
+        self._flusher_pid = None
+        # Each thread keeps the shard it was dealt in turn on first use. Thread
+        # idents are aligned addresses, so ident % shards would pick one shard
+        self._local = threading.local()
+        self._next_shard = itertools.count()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self._shards[next(self._next_shard) % len(self._shards)]
+            return shard
+
+    def record(self, post_id, viewer=None):
+        lock, hits, sketches = self._shard()
+        with lock:
+            hits[post_id] += 1
+            if viewer is not None:
+                sketch = sketches.get(post_id)
+                if sketch is None:
+                    sketch = sketches[post_id] = HyperLogLog()
+                sketch.add(viewer)
+        # Checked by process, since a forked worker does not inherit the thread
+        if self.flush_interval is not None and self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._flusher_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, name='view-flusher', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush_logging_errors()
+
+    def flush_logging_errors(self):
+        """Flush, logging rather than raising a failure; the hits stay buffered for the next flush."""
+        close_old_connections()
+        try:
+            return self.flush()
+        except Exception:
+            logger.exception("Flushing buffered post views failed")
+            return 0
+        finally:
+            close_old_connections()
+
+    def clear(self):
+        """Discard every buffered hit and sketch."""
+        self._drain()
+
+    def _drain(self):
+        hits = Counter()
+        sketches = {}
+        for lock, shard_hits, shard_sketches in self._shards:
+            with lock:
+                drained_hits = shard_hits.copy()
+                drained_sketches = shard_sketches.copy()
+                shard_hits.clear()
+                shard_sketches.clear()
+            hits.update(drained_hits)
+            for post_id, sketch in drained_sketches.items():
+                if post_id in sketches:
+                    sketches[post_id].merge(sketch)
+                else:
+                    sketches[post_id] = sketch
+        return hits, sketches
+
+    def _restore(self, hits, sketches):
+        """Put drained data back, so that a failed write is retried by the next flush."""
+        lock, shard_hits, shard_sketches = self._shard()
+        with lock:
+            shard_hits.update(hits)
+            for post_id, sketch in sketches.items():
+                if post_id in shard_sketches:
+                    shard_sketches[post_id].merge(sketch)
+                else:
+                    shard_sketches[post_id] = sketch
+
+    def flush(self, blocking=True):
+        """Write buffered hits to the database; returns the number of posts updated.
+
+        With ``blocking=False`` the call returns at once if another thread is
+        already flushing. Failed writes are put back and the error is raised.
+        """
+        if not self._flush_lock.acquire(blocking=blocking):
+            return 0
+        try:
+            hits, sketches = self._drain()
+            if not hits and not sketches:
+                return 0
+            try:
+                _write_hits(hits)
+            except Exception:
+                self._restore(hits, sketches)
+                raise
+            try:
+                _write_sketches(sketches, localdate())
+            except Exception:
+                self._restore({}, sketches)
+                raise
+            return len(hits)
+        finally:
+            self._flush_lock.release()
+
+
+def _write_hits(hits):
+    items = list(hits.items())
+    # All or nothing, so that a failed flush can put every hit back without double counting
+    with transaction.atomic():
+        for start in range(0, len(items), FLUSH_BATCH_SIZE):
+            batch = items[start:start + FLUSH_BATCH_SIZE]
+            # One UPDATE ... SET views = views + CASE id WHEN ... END per batch
+            Post.objects.filter(pk__in=[post_id for post_id, _ in batch]).update(
+                views=F('views') + Case(*[When(pk=post_id, then=count) for post_id, count in batch], default=0)
+            )
+
+
+def _write_sketches(sketches, day):
+    if not sketches:
+        return
+    post_ids = list(sketches)
+    with transaction.atomic():
+        # Missing rows are first inserted empty, ignoring rows another worker
+        # inserted meanwhile; every sketch is then merged into a locked row,
+        # so neither worker's first sketch of the day is dropped
+        stored_ids = set(PostDailyViewers.objects.filter(post_id__in=post_ids, day=day).values_list('post_id', flat=True))
+        missing_ids = [post_id for post_id in post_ids if post_id not in stored_ids]
+        if missing_ids:
+            empty = bytes(HyperLogLog().registers)
+            PostDailyViewers.objects.bulk_create(
+                [
+                    PostDailyViewers(post_id=post_id, day=day, sketch=empty)
+                    for post_id in Post.objects.filter(pk__in=missing_ids).values_list('pk', flat=True)
+                ],
+                batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True,
+            )
+        # Locked in post order, so that concurrent flushes cannot deadlock
+        rows = list(PostDailyViewers.objects.select_for_update().filter(post_id__in=post_ids, day=day).order_by('post_id'))
+        for row in rows:
+            merged = HyperLogLog(row.sketch)
+            merged.merge(sketches[row.post_id])
+            row.sketch = bytes(merged.registers)
+        PostDailyViewers.objects.bulk_update(rows, ['sketch'], batch_size=FLUSH_BATCH_SIZE)
+
+
+def unique_viewers(post_id, days=1):
+    """Estimate distinct viewers of a post over the last ``days`` days (flushed data only)."""
+    since = localdate() - timedelta(days=days - 1)
+    combined = HyperLogLog()
+    for sketch in PostDailyViewers.objects.filter(post_id=post_id, day__gte=since).values_list('sketch', flat=True):
+        combined.merge(HyperLogLog(sketch))
+    return combined.count()
+
+
+view_buffer = ViewBuffer()
+
+# Do not lose the last few seconds of hits when a worker shuts down cleanly
+atexit.register(view_buffer.flush_logging_errors)
@@ -1,4 +1,4 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework.status import (
@@ -9,13 +9,23 @@ from rest_framework.status import (
     HTTP_204_NO_CONTENT,
     HTTP_200_OK,
     HTTP_403_FORBIDDEN,
+    HTTP_409_CONFLICT,
 )
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.throttling import BaseThrottle
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from .models import Post, Category, Tag, Comment, PostRating
-from .serializers import PostSerializer, UserSerializer, CategorySerializer, TagSerializer, CommentSerializer, PostRatingSerializer
-from django.db.models import Q, Avg
+from .models import Post, Category, Tag, Comment, PostRating, Follow, PostRevision
+from .tasks import rebuild_sitemaps, recompute_average_rating
+from .autocomplete import tag_index, category_index, MAX_LIMIT
+from .timeline import read_feed, decode_cursor, remove_author_from_feed
+from .throttling import LoginThrottle, RegisterThrottle, LikeThrottle, RateThrottle, CommentThrottle
+from .serializers import EditConflict, PostSerializer, UserSerializer, CategorySerializer, TagSerializer, CommentSerializer, PostRatingSerializer
+from django.db.models import Avg, Count, Prefetch, Q
+from django.http import FileResponse, Http404, HttpResponse
+from django.views.decorators.http import require_GET
+from .streaming import stream_json_list
+from .viewcounts import unique_viewers, view_buffer
 from rest_framework.pagination import PageNumberPagination
 
 
@@ -47,7 +57,7 @@ def list_or_create_posts(request):
 
 # Retrieve, Update, Patch, or Delete a Post
 @api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticatedOrReadOnly])  # Published posts are public, so sitemap and feed links work for crawlers
 def post_detail(request, id):
     try:
         post = Post.objects.get(pk=id)
@@ -63,6 +73,12 @@ def post_detail(request, id):
         return Response({"error": "Post not found"}, status=HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
+        # Buffered in memory and flushed in batches, so reads stay write-free
+        if request.user.is_authenticated:
+            viewer = f'user:{request.user.pk}'
+        else:
+            viewer = f'ip:{BaseThrottle().get_ident(request)}'
+        view_buffer.record(post.pk, viewer=viewer)
         serializer = PostSerializer(post)
         return Response(serializer.data, status=HTTP_200_OK)
 
@@ -76,7 +92,14 @@ def post_detail(request, id):
         partial = request.method == 'PATCH'
         serializer = PostSerializer(post, data=request.data, partial=partial)
         if serializer.is_valid():
-            serializer.save()
+            try:
+                # The serializer records the content revision along with the save
+                serializer.save(revision_author=request.user)
+            except EditConflict:
+                return Response(
+                    {"error": "This post was modified by someone else. Reload it and try again."},
+                    status=HTTP_409_CONFLICT,
+                )
             return Response(serializer.data, status=HTTP_200_OK)
         return Response(serializer.errors, status=HTTP_400_BAD_REQUEST)
 
@@ -93,6 +116,7 @@ def post_detail(request, id):
 # User Registration
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RegisterThrottle])
 def register_user(request):
     serializer = UserSerializer(data=request.data)
     if serializer.is_valid():
@@ -105,6 +129,7 @@ def register_user(request):
 # User Login
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([LoginThrottle])
 def login_user(request):
     if request.method != 'POST':
         return Response({"error": "Method not allowed"}, status=405)
@@ -122,6 +147,19 @@ def login_user(request):
     return Response({'error': 'Invalid credentials'}, status=HTTP_400_BAD_REQUEST)
 
 
+def _stream_posts(posts):
+    """Stream an unpaginated post list, loading related rows one chunk at a time.
+
+    Likers are prefetched per chunk as bare ids, and counted in the query.
+    """
+    posts = (
+        posts.select_related('author', 'category')
+        .prefetch_related('tags', Prefetch('likes', queryset=User.objects.only('id')))
+        .annotate(like_count=Count('likes', distinct=True))
+    )
+    return stream_json_list(posts, PostSerializer)
+
+
 # Filter Posts by Category (Category ID)
 @api_view(['GET'])
 @permission_classes([AllowAny])  # Allow public access
@@ -129,8 +167,7 @@ def filter_posts_by_category(request, category_id):
     posts = Post.objects.filter(category_id=category_id)
     if not posts.exists():
         return Response({"error": "No posts found for this category"}, status=HTTP_404_NOT_FOUND)
-    serializer = PostSerializer(posts, many=True)
-    return Response(serializer.data, status=HTTP_200_OK)
+    return _stream_posts(posts)
 
 
 # Filter Posts by Tag (Tag Name)
@@ -140,8 +177,7 @@ def filter_posts_by_tag(request, tag_name):
     posts = Post.objects.filter(tags__name__icontains=tag_name)
     if not posts.exists():
         return Response({"error": "No posts found for this tag"}, status=HTTP_404_NOT_FOUND)
-    serializer = PostSerializer(posts, many=True)
-    return Response(serializer.data, status=HTTP_200_OK)
+    return _stream_posts(posts)
 
 
 # View Posts by Category Name
@@ -151,8 +187,7 @@ def posts_by_category(request, category_name):
     posts = Post.objects.filter(category__name=category_name)
     if not posts.exists():
         return Response({"error": f"No posts found for category '{category_name}'."}, status=HTTP_404_NOT_FOUND)
-    serializer = PostSerializer(posts, many=True)
-    return Response(serializer.data, status=HTTP_200_OK)
+    return _stream_posts(posts)
 
 
 # View Posts by Author Username
@@ -162,8 +197,7 @@ def posts_by_author(request, author_username):
     posts = Post.objects.filter(author__username=author_username)
     if not posts.exists():
         return Response({"error": f"No posts found for author '{author_username}'."}, status=HTTP_404_NOT_FOUND)
-    serializer = PostSerializer(posts, many=True)
-    return Response(serializer.data, status=HTTP_200_OK)
+    return _stream_posts(posts)
 
 # Publish Post
 @api_view(['POST'])
@@ -215,9 +249,8 @@ def search_and_filter_posts(request):
     if tag_name:
         posts = posts.filter(tags__name__iexact=tag_name)
 
-    # Serialize and return results
-    serializer = PostSerializer(posts, many=True)
-    return Response(serializer.data, status=HTTP_200_OK)
+    # Serialize and stream results
+    return _stream_posts(posts)
 
     # Pagination class for blog posts
 class PostPagination(PageNumberPagination):
@@ -268,6 +301,7 @@ def list_or_create_posts(request):
 # Create or List Comments for a Post
 @api_view(['GET', 'POST'])
 @permission_classes([AllowAny])  # Anyone can view comments, only authenticated users can create
+@throttle_classes([CommentThrottle])
 def comments_for_post(request, post_id):
     try:
         post = Post.objects.get(pk=post_id)
@@ -275,9 +309,8 @@ def comments_for_post(request, post_id):
         return Response({"error": "Post not found"}, status=HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
-        comments = Comment.objects.filter(post=post)
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data, status=HTTP_200_OK)
+        comments = Comment.objects.filter(post=post).select_related('author')
+        return stream_json_list(comments, CommentSerializer)
 
     if request.method == 'POST':
         if not request.user.is_authenticated:
@@ -315,6 +348,7 @@ def update_or_delete_comment(request, comment_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([LikeThrottle])
 def like_post(request, post_id):
     try:
         post = Post.objects.get(id=post_id)
@@ -329,6 +363,7 @@ def like_post(request, post_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([RateThrottle])
 def rate_post(request, post_id):
     try:
         post = Post.objects.get(pk=post_id)
@@ -358,9 +393,207 @@ def rate_post(request, post_id):
         rating.rating = rating_value
         rating.save()
 
-    # Recalculate the average rating
-    average_rating = PostRating.objects.filter(post=post).aggregate(avg_rating=Avg('rating'))['avg_rating']
-    post.average_rating = average_rating
-    post.save()
+    # The rater sees the average including their rating: one indexed aggregate,
+    # with no write to the post row. Storing it on the post, which every
+    # rating of a popular post would contend for, is left to the task queue
+    average = PostRating.objects.filter(post=post).aggregate(average=Avg('rating'))['average']
+    recompute_average_rating.enqueue(post.pk, dedup_key=f'average-rating:{post.pk}')
+
+    return Response({"message": "Rating submitted successfully", "average_rating": average}, status=HTTP_200_OK)
+
 
-    return Response({"message": "Rating submitted successfully", "average_rating": average_rating}, status=HTTP_200_OK)
\ No newline at end of file
+# Related Posts (precomputed by blog.similarity)
+@api_view(['GET'])
+@permission_classes([AllowAny])  # Allow public access
+def related_posts(request, post_id):
+    if not Post.objects.filter(pk=post_id, status='published').exists():
+        return Response({"error": "Post not found"}, status=HTTP_404_NOT_FOUND)
+    # The index is refreshed in the background, so a neighbour may have been unpublished since
+    posts = (
+        Post.objects.filter(related_to__post_id=post_id, status='published')
+        .select_related('author', 'category')
+        .prefetch_related('tags', Prefetch('likes', queryset=User.objects.only('id')))
+        .order_by('-related_to__score')
+    )
+    serializer = PostSerializer(posts, many=True)
+    return Response(serializer.data, status=HTTP_200_OK)
+
+# Follow or Unfollow an Author
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def follow_user(request, username):
+    try:
+        author = User.objects.get(username=username)
+    except User.DoesNotExist:
+        return Response({"error": "User not found"}, status=HTTP_404_NOT_FOUND)
+
+    if author == request.user:
+        return Response({"error": "You cannot follow yourself"}, status=HTTP_400_BAD_REQUEST)
+
+    if request.method == 'POST':
+        Follow.objects.get_or_create(follower=request.user, followed=author)
+        return Response({"message": f"You are now following {author.username}."}, status=HTTP_200_OK)
+
+    Follow.objects.filter(follower=request.user, followed=author).delete()
+    remove_author_from_feed(request.user.pk, author.pk)
+    return Response({"message": f"You have unfollowed {author.username}."}, status=HTTP_200_OK)
+
+
+# Personalized Feed (cursor paginated)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def user_feed(request):
+    cursor = request.query_params.get('cursor')
+    try:
+        cursor = decode_cursor(cursor) if cursor else None
+        page_size = min(int(request.query_params.get('page_size', PostPagination.page_size)), PostPagination.max_page_size)
+    except ValueError:
+        return Response({"error": "Invalid cursor or page size"}, status=HTTP_400_BAD_REQUEST)
+    if page_size < 1:
+        return Response({"error": "Invalid cursor or page size"}, status=HTTP_400_BAD_REQUEST)
+
+    posts, next_cursor = read_feed(request.user.pk, cursor=cursor, limit=page_size)
+    serializer = PostSerializer(posts, many=True)
+    return Response({"next_cursor": next_cursor, "results": serializer.data}, status=HTTP_200_OK)
+
+
+def _get_visible_post(request, id):
+    """Return (post, None) or (None, error response), applying post_detail's draft rule."""
+    try:
+        post = Post.objects.get(pk=id)
+    except Post.DoesNotExist:
+        return None, Response({"error": "Post not found"}, status=HTTP_404_NOT_FOUND)
+    if post.status == 'draft' and post.author != request.user:
+        return None, Response(
+            {"error": "You do not have permission to view this draft post."},
+            status=HTTP_403_FORBIDDEN,
+        )
+    return post, None
+
+
+# List Revisions of a Post
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def post_revisions(request, id):
+    post, error = _get_visible_post(request, id)
+    if error:
+        return error
+    revisions = PostRevision.objects.filter(post=post).select_related('author').defer('data')
+    data = [
+        {
+            "number": revision.number,
+            "author": revision.author.username if revision.author else None,
+            "created_at": revision.created_at,
+        }
+        for revision in revisions
+    ]
+    return Response(data, status=HTTP_200_OK)
+
+
+# Retrieve the Content of One Revision
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def post_revision_detail(request, id, number):
+    post, error = _get_visible_post(request, id)
+    if error:
+        return error
+    from .revisions import revision_content
+
+    content = revision_content(post.pk, number)
+    if content is None:
+        return Response({"error": "Revision not found"}, status=HTTP_404_NOT_FOUND)
+    return Response({"number": number, "content": content}, status=HTTP_200_OK)
+
+
+def _autocomplete(request, index):
+    prefix = request.query_params.get('q', '').strip()
+    if not prefix:
+        return Response({"error": "Query parameter 'q' is required"}, status=HTTP_400_BAD_REQUEST)
+    try:
+        limit = min(int(request.query_params.get('limit', 10)), MAX_LIMIT)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return Response({"error": "Limit must be a positive integer"}, status=HTTP_400_BAD_REQUEST)
+    data = [{"name": name, "count": count} for name, count in index.search(prefix, limit)]
+    return Response(data, status=HTTP_200_OK)
+
+
+# Tag Autocomplete (served from an in-memory prefix index)
+@api_view(['GET'])
+@permission_classes([AllowAny])  # Allow public access
+def autocomplete_tags(request):
+    return _autocomplete(request, tag_index)
+
+
+# Category Autocomplete (served from an in-memory prefix index)
+@api_view(['GET'])
+@permission_classes([AllowAny])  # Allow public access
+def autocomplete_categories(request):
+    return _autocomplete(request, category_index)
+
+
+# Sitemap Index (files are rebuilt incrementally by the build_sitemaps command)
+@require_GET
+def sitemap_index(request):
+    # Syndication is only served to crawlers, so workers load it on first use
+    from .syndication import sitemap_index_path
+
+    if not sitemap_index_path().exists():
+        # A first build walks every post, far too long for a request; a task
+        # worker builds it and crawlers come back after Retry-After
+        rebuild_sitemaps.enqueue(dedup_key='rebuild-sitemaps')
+        response = HttpResponse("Sitemap is being generated", status=503, content_type='text/plain')
+        response['Retry-After'] = '600'
+        return response
+    return FileResponse(open(sitemap_index_path(), 'rb'), content_type='application/xml')
+
+
+# One Sitemap File
+@require_GET
+def sitemap_section(request, number):
+    from .syndication import sitemap_chunk_path
+
+    path = sitemap_chunk_path(number)
+    if not path.exists():
+        raise Http404("Sitemap not found")
+    return FileResponse(open(path, 'rb'), content_type='application/xml')
+
+
+def _atom_feed(request, kind, value):
+    from .syndication import build_feed
+
+    path = build_feed(kind, value, request.build_absolute_uri())
+    if path is None:
+        raise Http404("No published posts for this feed")
+    return FileResponse(open(path, 'rb'), content_type='application/atom+xml; charset=utf-8')
+
+
+# Atom Feeds by Category, Author and Tag
+@require_GET
+def category_feed(request, category_name):
+    return _atom_feed(request, 'category', category_name)
+
+
+@require_GET
+def author_feed(request, author_username):
+    return _atom_feed(request, 'author', author_username)
+
+
+@require_GET
+def tag_feed(request, tag_name):
+    return _atom_feed(request, 'tag', tag_name)
+
+
+# View Statistics for a Post
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def post_view_stats(request, id):
+    post, error = _get_visible_post(request, id)
+    if error:
+        return error
+    return Response({
+        "views": post.views,
+        "unique_viewers_today": unique_viewers(post.pk, days=1),
+        "unique_viewers_7_days": unique_viewers(post.pk, days=7),
+    }, status=HTTP_200_OK)
@@ -101,6 +101,11 @@ STATIC_URL = 'static/'
 
 # Directory for collected static files
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Public base URL and output directory for sitemaps and Atom feeds (see blog/syndication.py)
+SITE_URL = 'https://JudithMusangi.pythonanywhere.com'
+SYNDICATION_ROOT = BASE_DIR / 'syndication'
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -112,4 +117,21 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',  # Require authentication by default
     ],
+    # PythonAnywhere serves the app behind one proxy, which appends the client
+    # address to X-Forwarded-For; throttles key anonymous clients by that entry
+    'NUM_PROXIES': 1,
+    # Token-bucket limits for write endpoints (see blog/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '10/min',
+        'register': '5/hour',
+        'like': '60/min',
+        'rate': '30/min',
+        'comment': '20/min',
+    },
 }
+
+# Cache alias used to share throttle buckets between workers; None keeps them in-process
+BLOG_THROTTLE_CACHE = None
+
+# Broker for background tasks (see blog/taskqueue.py): 'database', 'memory' or 'eager'
+BLOG_TASK_BROKER = 'database'
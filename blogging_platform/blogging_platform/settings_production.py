@@ -0,0 +1,20 @@
+"""
+Production settings for blogging_platform.
+
+Select with DJANGO_SETTINGS_MODULE=blogging_platform.settings_production.
+Development-only apps are left out so workers start faster; set
+BLOG_ENABLE_ADMIN=0 to also skip the admin on API-only workers.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS
+
+DEBUG = False
+
+DEV_ONLY_APPS = ['django_extensions']
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in DEV_ONLY_APPS]
+
+if os.environ.get('BLOG_ENABLE_ADMIN', '1') == '0':
+    INSTALLED_APPS.remove('django.contrib.admin')
@@ -14,17 +14,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 from django.views.generic import TemplateView
 
 urlpatterns = [
-    # Admin URL
-    path('admin/', admin.site.urls),
-
     # Blog app URLs
     path('', include('blog.urls')),
 
     # Template view for home page
     path('', TemplateView.as_view(template_name='index.html'), name='home'),
 ]
+
+# Admin URL (left out by production settings on API-only workers)
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))